@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Benchmarks for evaluation.py on synthetic data.
+
+Generates KitHub-shaped courses, serves them from a local stub of the API and
+times every phase of the pipeline separately.
+
+@package benchmark
+'''
+import sys
+import os
+import io
+import json
+import csv
+import random
+import tempfile
+import threading
+import platform
+import subprocess
+import argparse
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from time import perf_counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlsplit, parse_qs
+
+import evaluation
+
+# term id used for the synthetic courses
+term_id = 1
+# first Monday of the synthetic semester
+semester_start = datetime(2015, 4, 13)
+# interval used for build_timetable and the ODS files
+window = ("2015-06-01", "2015-06-19")
+# length of an appointment in minutes
+appointment_length = 90
+
+# all phases in the order they are run
+phases = ["fetch", "fetch_bulk", "json_load", "parse_appointments", "decode_files", "decode_files_parallel", "store_load", "build_timetable",
+          "aliases", "render_timetable", "render_output", "render_json", "render_csv", "render_html"]
+
+
+# create the replies of the API for course_count courses, with
+# appointments_per_course appointments each, taking place once or twice a week
+def generate_courses(course_count, appointments_per_course, room_count, lecturer_count, seed=0):
+    random_generator = random.Random(seed)
+    rooms = ["{0}.{1:02d} Hörsaal {2}".format(10 + i % 40, i % 100, i) for i in range(room_count)]
+    lecturers = ["Prof. Dr. Lecturer {0}".format(i) for i in range(lecturer_count)]
+    start_times = evaluation.block_schemes[evaluation.block_scheme]
+
+    replies = {}
+    for i in range(course_count):
+        lvnr = 4000000 + i
+        slots = [(random_generator.randrange(5), random_generator.choice(start_times))
+                 for _ in range(random_generator.choice([1, 2]))]
+        course_rooms = [random_generator.choice(rooms) for _ in slots]
+        dates = []
+        for n in range(appointments_per_course):
+            weekday, start_time = slots[n % len(slots)]
+            start = semester_start + timedelta(weeks=n // len(slots), days=weekday,
+                                               hours=start_time.hour, minutes=start_time.minute)
+            end = start + timedelta(minutes=appointment_length)
+            dates.append({"start_time": start.strftime("%Y-%m-%dT%H:%M:%S+02:00"),
+                          "end_time": end.strftime("%Y-%m-%dT%H:%M:%S+02:00"),
+                          "room": course_rooms[n % len(slots)]})
+        names = random_generator.sample(lecturers, min(len(lecturers), random_generator.choice([1, 1, 2, 3])))
+        replies[str(lvnr)] = [{"id": 100000 + i, "no": str(lvnr), "name": "Course {0}".format(i),
+                               "lecturer": ", ".join(names), "dates": dates}]
+    return replies
+
+
+# read a recorded listing of a term, a JSON array of courses as sent by
+# api_bulk_url, and group it into replies like generate_courses
+def read_dump(filename):
+    replies = {}
+    with open(filename, 'rb') as f:
+        for obj in evaluation.iter_json_array(iter(lambda: f.read(64 * 1024), b"")):
+            replies.setdefault(str(obj["no"]), []).append(obj)
+    return replies
+
+
+# write input.csv for all courses, with a few of them excluded, and alias
+# files with an alias for every second name
+def write_input_files(config, replies, seed=0):
+    random_generator = random.Random(seed)
+    with open(config.input_file, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csvwriter.writerow(["LVNR", "Studiengang", "Name", "Ignorieren", "Übung", "Praktikum"])
+        for lvnr, reply in replies.items():
+            csvwriter.writerow([lvnr, random_generator.choice(["Bachelor", "Master", "Lehramt"]), reply[0]["name"],
+                                "x" if random_generator.random() < 0.05 else "",
+                                "x" if random_generator.random() < 0.3 else "",
+                                "x" if random_generator.random() < 0.1 else ""])
+    write_alias_files(config, replies)
+
+
+def write_alias_files(config, replies):
+    lecturers = {}
+    rooms = {}
+    for reply in replies.values():
+        for lecturer in reply[0]["lecturer"].split(","):
+            lecturers[lecturer.strip()] = lecturer.strip()
+        for date in reply[0]["dates"]:
+            rooms[date["room"]] = date["room"]
+    for aliases in (lecturers, rooms):
+        for i, name in enumerate(list(aliases)):
+            if i % 2 == 0:
+                aliases[name] = name.split(" ")[-1]
+    write_aliases(config.lecturers_file, lecturers)
+    write_aliases(config.rooms_file, rooms)
+
+
+# write a whole alias file like evaluation.py reads it, names without alias
+# get an empty second column
+def write_aliases(filename, source):
+    with open(filename, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csvwriter.writerow(['Name', 'Alias'])
+        for name, alias in source.items():
+            if alias == name:
+                alias = ""
+            csvwriter.writerow([name, alias])
+
+
+# serves the generated replies like terms/{term_id}/events.json of KitHub's
+# API, for single courses and as listing of the term in pages, and counts the
+# requests
+class StubServer:
+
+    # with paging False, the whole listing is sent for every page, like a
+    # server that does not know the page parameter
+    def __init__(self, replies, paging=True):
+        bodies = {lvnr: json.dumps(reply).encode('utf8') for lvnr, reply in replies.items()}
+        listing = [obj for lvnr in sorted(replies, key=int) for obj in replies[lvnr]]
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                query = parse_qs(urlsplit(self.path).query)
+                if "page" in query:
+                    page, per_page = int(query["page"][0]), int(query["per_page"][0])
+                    if paging:
+                        body = json.dumps(listing[(page - 1) * per_page:page * per_page]).encode('utf8')
+                    else:
+                        body = json.dumps(listing).encode('utf8')
+                else:
+                    body = bodies.get(query.get("no", [""])[0])
+                if body is None:
+                    self.send_response(404)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = "http://127.0.0.1:{0}/api/terms/{{0}}/events.json?type=detail&no={{1}}".format(self.server.server_port)
+        self.bulk_url = "http://127.0.0.1:{0}/api/terms/{{0}}/events.json?type=detail&page={{1}}&per_page={{2}}".format(self.server.server_port)
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+# best time of repeat runs of function, setup is run before each run and not
+# measured, output of both is discarded
+def measure(function, setup=None, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        with redirect_stdout(io.StringIO()):
+            if setup is not None:
+                setup()
+            start = perf_counter()
+            result = function()
+            duration = perf_counter() - start
+        best = duration if best is None else min(best, duration)
+    return best, result
+
+
+# run all phases on one set of synthetic data, or on the given replies,
+# return the timings in seconds and some counts describing the data
+def run(course_count, appointments_per_course, room_count, lecturer_count, repeat=3, seed=0, replies=None,
+        interval=window, processes=1):
+    with tempfile.TemporaryDirectory() as directory:
+        if replies is None:
+            replies = generate_courses(course_count, appointments_per_course, room_count, lecturer_count, seed)
+        server = StubServer(replies)
+        config = evaluation.Config(
+            term_id=term_id, api_url=server.url, api_bulk_url=server.bulk_url, bulk_page_size=250,
+            fetch_rate_limit=0, eva_windows=[interval],
+            course_store_file=os.path.join(directory, "courses.sqlite"),
+            json_directory=os.path.join(directory, "courses"),
+            input_file=os.path.join(directory, "input.csv"),
+            lecturers_file=os.path.join(directory, "lecturers.csv"),
+            rooms_file=os.path.join(directory, "rooms.csv"),
+            output_file=os.path.join(directory, "timetable.ods"),
+            output_comparison_file=os.path.join(directory, "output.ods"))
+        write_input_files(config, replies, seed)
+        input_rows = evaluation.read_input(config.input_file)
+        course_numbers = [row[0] for row in input_rows[1:] if not evaluation.is_excluded(row)]
+        starttime, endtime = config.windows()[0]
+        blocks = config.blocks()
+        timings = {}
+        requests = {}
+
+        try:
+            def remove_store():
+                if os.path.exists(config.course_store_file):
+                    os.remove(config.course_store_file)
+                server.requests = 0
+
+            def fetch():
+                store = evaluation.CourseStore(config.course_store_file)
+                evaluation.get_courses(store, course_numbers, config)
+                store.close()
+            timings["fetch"], _ = measure(fetch, remove_store, repeat)
+            requests["fetch"] = server.requests
+
+            config.fetch_bulk = True
+            timings["fetch_bulk"], _ = measure(fetch, remove_store, repeat)
+            requests["fetch_bulk"] = server.requests
+            config.fetch_bulk = False
+        finally:
+            server.stop()
+
+        bodies = [json.dumps(replies[lvnr]) for lvnr in course_numbers]
+        timings["json_load"], decoded = measure(lambda: [json.loads(body) for body in bodies], repeat=repeat)
+
+        timings["parse_appointments"], _ = measure(
+            lambda: [evaluation.course_parse_appointments(data[0]["dates"]) for data in decoded],
+            evaluation.datetime_cache.clear, repeat)
+
+        # JSON files as written by earlier versions, decoded in this process
+        # and by a pool of processes
+        os.makedirs(config.json_directory)
+        filenames = []
+        for lvnr, body in zip(course_numbers, bodies):
+            filenames.append(os.path.join(config.json_directory, "{0}.json".format(lvnr)))
+            with open(filenames[-1], 'w') as f:
+                f.write(body)
+        timings["decode_files"], _ = measure(
+            lambda: evaluation.decode_course_files(filenames), evaluation.datetime_cache.clear, repeat)
+        timings["decode_files_parallel"], _ = measure(
+            lambda: evaluation.decode_course_files(filenames, processes, config.decode_chunk_size),
+            evaluation.datetime_cache.clear, repeat)
+
+        def store_load():
+            store = evaluation.CourseStore(config.course_store_file)
+            courses_loaded = store.load_courses(config.term_id, course_numbers)
+            store.close()
+            return evaluation.courses_from_input(config, input_rows, courses_loaded)
+        timings["store_load"], courses = measure(store_load, repeat=repeat)
+
+        timings["build_timetable"], timetable = measure(
+            lambda: evaluation.build_timetable(courses, starttime, endtime, blocks), repeat=repeat)
+
+        def aliases():
+            lecturers = evaluation.AliasFile(config.lecturers_file)
+            rooms = evaluation.AliasFile(config.rooms_file)
+            evaluation.update_aliases(config, courses.values(), lecturers, rooms)
+        timings["aliases"], _ = measure(aliases, lambda: write_alias_files(config, replies), repeat)
+
+        timings["render_timetable"], _ = measure(
+            lambda: evaluation.write_timetable(config, timetable, courses, config.output_file), repeat=repeat)
+        timings["render_output"], _ = measure(
+            lambda: evaluation.write_output_comparison(config, input_rows, courses, timetable, config.output_comparison_file), repeat=repeat)
+        for output_format in ["json", "csv", "html"]:
+            renderer, extension = evaluation.timetable_renderers[output_format]
+            filename = os.path.join(directory, "timetable" + extension)
+            timings["render_" + output_format], _ = measure(
+                lambda: renderer(config, timetable, courses, filename), repeat=repeat)
+
+        counts = {"courses": len(courses),
+                  "appointments": sum(len(course.appointments) for course in courses.values()),
+                  "appointments_in_window": timetable.appointment_count(),
+                  "missed": len(timetable.missed),
+                  "requests_fetch": requests["fetch"],
+                  "requests_fetch_bulk": requests["fetch_bulk"]}
+        return timings, counts
+
+
+# compare parse_datetime with parse_datetimes on a semester of timestamps
+def benchmark_datetime_parsing(courses=500, weeks=15, repeat=5):
+    # every course takes place twice a week, in one of the usual blocks
+    start_times = evaluation.block_schemes[evaluation.block_scheme]
+    strings = []
+    for course in range(courses):
+        for week in range(weeks):
+            for day in (course % 5, (course + 2) % 5):
+                block_time = start_times[course % len(start_times)]
+                date = datetime(2015, 4, 13 + day, block_time.hour, block_time.minute) + timedelta(weeks=week)
+                strings.append(date.strftime("%Y-%m-%dT%H:%M:%S+02:00"))
+
+    reference, _ = measure(lambda: [evaluation.parse_datetime(string) for string in strings], repeat=repeat)
+    uncached, _ = measure(lambda: [evaluation.parse_datetime_fast(string) for string in strings], repeat=repeat)
+    batch, _ = measure(lambda: evaluation.parse_datetimes(strings), evaluation.datetime_cache.clear, repeat)
+    assert evaluation.parse_datetimes(strings) == [evaluation.parse_datetime(string) for string in strings]
+    print("Parsing {0} timestamps ({1} distinct), best of {2}:".format(len(strings), len(set(strings)), repeat))
+    for name, duration in [("strptime", reference), ("slicing", uncached), ("batch", batch)]:
+        print("\t{0:10} {1:8.2f} ms {2:6.1f}x".format(name, duration * 1000, reference / duration))
+
+
+# commit of the working copy, to tell results of different versions apart
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time every phase of evaluation.py on synthetic data.")
+    parser.add_argument("--courses", type=int, nargs="+", default=[50, 500],
+                        help="numbers of courses, one benchmark for each (default: 50 500)")
+    parser.add_argument("--appointments", type=int, default=30, help="appointments per course (default: 30)")
+    parser.add_argument("--rooms", type=int, default=60, help="number of distinct rooms (default: 60)")
+    parser.add_argument("--lecturers", type=int, default=200, help="number of distinct lecturers (default: 200)")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per phase, the best is reported (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the random data (default: 0)")
+    parser.add_argument("--output", help="write the results as JSON to this file, - for stdout")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1,
+                        help="processes decoding JSON files in parallel (default: number of CPUs)")
+    parser.add_argument("--dump", help="run on the courses of a recorded listing of a term instead of synthetic ones")
+    parser.add_argument("--window", nargs=2, default=list(window), metavar=("START", "END"),
+                        help="interval of the timetable (default: {0} {1})".format(*window))
+    parser.add_argument("--datetime", action="store_true", help="only compare the speed of the datetime parsers")
+    args = parser.parse_args()
+
+    if args.datetime:
+        benchmark_datetime_parsing()
+        return
+
+    results = {"revision": git_revision(), "python": platform.python_version(),
+               "date": datetime.now().isoformat(timespec="seconds"), "runs": []}
+    replies = read_dump(args.dump) if args.dump else None
+    for course_count in [len(replies)] if replies else args.courses:
+        timings, counts = run(course_count, args.appointments, args.rooms, args.lecturers, args.repeat, args.seed,
+                              replies, tuple(args.window), args.processes)
+        results["runs"].append({"parameters": {"courses": course_count, "appointments": args.appointments,
+                                               "rooms": args.rooms, "lecturers": args.lecturers,
+                                               "repeat": args.repeat, "seed": args.seed, "processes": args.processes},
+                                "counts": counts, "seconds": timings})
+        print("{0} courses, {1} appointments, {2} within the interval:".format(
+            counts["courses"], counts["appointments"], counts["appointments_in_window"]), file=sys.stderr)
+        print("\t{0} requests for single courses, {1} for the listing of the term".format(
+            counts["requests_fetch"], counts["requests_fetch_bulk"]), file=sys.stderr)
+        for phase in phases:
+            print("\t{0:20} {1:10.2f} ms".format(phase, timings[phase] * 1000), file=sys.stderr)
+
+    if args.output == "-":
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    elif args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,16 +5,22 @@ Documentation, License etc.
 
 @package evaluation
 '''
+# only modules needed by everything are imported here, the ones for
+# downloading, the course store and the ODS files are imported where they are
+# used, so importing this module as a library stays fast
 import sys
 import os
+import io
 import glob
 import json
-import urllib.request
+import threading
 import csv
+from contextlib import contextmanager, redirect_stdout
+from bisect import bisect_left, bisect_right
 from datetime import datetime, time
-
-from simpleodspy.sodsspreadsheet import SodsSpreadSheet
-from simpleodspy.sodsods import SodsOds
+from time import monotonic, sleep
+from time import time as timestamp
+from time import perf_counter
 
 ###
 # Configuration options
@@ -35,13 +41,19 @@ term_id = 10222 # Sommersemester 2015
 eva_starttime_str = "2015-06-01T00:00:00+02:00"
 eva_endtime_str = "2015-06-19T23:59:59+02:00"
 
+# to compare several candidate intervals at once, list them here as pairs of
+# start and end time, a timetable is generated for each of them, more can be
+# given with --window
+eva_windows = []
+
 ###
 # General options
 ###
 
 # set to True for more output
 verbose_output = False
-# set to true if you want the timetable printed to stdout
+# set to true if you want the timetable printed to stdout, same as adding
+# "terminal" to output_formats
 terminal_timetable = False
 
 input_file = "input.csv"
@@ -49,6 +61,21 @@ lecturers_file = "lecturers.csv"
 rooms_file = "rooms.csv"
 output_file = "timetable.ods"
 output_comparison_file = "output.ods"
+# formats the timetable is written in: "ods", "json", "csv", "html", each
+# next to output_file with its extension, and "terminal", which prints it;
+# output_comparison_file is only written with "ods"; can be set with --format
+output_formats = ["ods", "terminal"] if terminal_timetable else ["ods"]
+# overview of all intervals when several are given
+windows_summary_file = "windows.csv"
+# number of processes that generate the timetables of several intervals,
+# 1 generates them one after the other
+window_processes = 1
+# in watch mode, check the input files for changes every this many seconds
+watch_interval = 0.5
+# only load the appointments within the intervals from the course store, so
+# the memory needed grows with the length of the intervals instead of the
+# semester; rooms used only outside the intervals are not added to rooms.csv
+load_window_only = False
 
 # append the course of studies to the name of each lecture
 show_course_of_studies = False
@@ -59,20 +86,78 @@ weekdays = {1: "Montag", 2: "Dienstag",
             3: "Mittwoch", 4: "Donnerstag", 5: "Freitag"}
 weekdays_short = {1: "Mo", 2: "Di", 3: "Mi", 4: "Do", 5: "Fr"}
 
-# path of the directory where the data downloaded from the API is stored
+# database where the data downloaded from the API is stored
+course_store_file = "courses.sqlite"
+# directory with JSON files of courses downloaded by earlier versions of this
+# script, they are imported into the database
 json_directory = "courses"
+# number of processes decoding the JSON files in json_directory, and the
+# number of files each of them decodes at a time, can be set with
+# --decode-processes
+decode_processes = 1
+decode_chunk_size = 50
+
+# URL of the API, {0} is replaced by the term id and {1} by the lecture ID
+api_url = "http://www.kithub.de/api/terms/{0}/events.json?type=detail&no={1}"
+# number of courses that are downloaded in parallel
+fetch_concurrency = 8
+# maximum number of requests per second sent to one host, 0 for no limit
+fetch_rate_limit = 10
+# number of retries if a download fails, before retry n the fetcher waits
+# fetch_backoff * 2^n seconds
+fetch_retries = 3
+fetch_backoff = 0.5
+# timeout for a single request in seconds
+fetch_timeout = 30
+# number of redirects that are followed for one request
+fetch_redirects = 5
+# download the listing of all courses of the term in a few requests instead
+# of one request per course, can be set with --bulk
+fetch_bulk = False
+# URL of the listing of all courses of a term, {0} is replaced by the term
+# id, {1} by the page starting at 1 and {2} by the number of courses per page
+api_bulk_url = "http://www.kithub.de/api/terms/{0}/events.json?type=detail&page={1}&per_page={2}"
+bulk_page_size = 1000
+# the listing is not read beyond this page, in case the server ignores page
+bulk_max_pages = 1000
+
+# file within json_directory that recorded when and in which version each
+# course was downloaded, imported together with the JSON files
+cache_manifest_file = "manifest.json"
+# downloaded courses older than this number of seconds are revalidated
+cache_ttl = 24 * 60 * 60
+# which downloaded courses are revalidated with the API:
+# "stale" only those older than cache_ttl, "all" every course,
+# "none" never, can be overridden with --refresh
+refresh_policy = "stale"
 
 # as %z is the offset with the format +HHMM, and without :,
 # delete all : while parsing
 datetime_format = "%Y-%m-%dT%H%M%S%z"  # 2014-06-11T19:00:00+02:00
 
-# start time of blocks in the timetable
-timetable_blocks = [{'time': time(hour=8, minute=0), 'block': 1},
-                    {'time': time(hour=9, minute=45), 'block': 2},
-                    {'time': time(hour=11, minute=30), 'block': 3},
-                    {'time': time(hour=14, minute=0), 'block': 4},
-                    {'time': time(hour=15, minute=45), 'block': 5},
-                    {'time': time(hour=17, minute=30), 'block': 6}]
+# start time of blocks in the timetable, one list per scheme, e.g. for
+# campuses with different schedules
+block_schemes = {
+    "kit": [time(hour=8, minute=0),
+            time(hour=9, minute=45),
+            time(hour=11, minute=30),
+            time(hour=14, minute=0),
+            time(hour=15, minute=45),
+            time(hour=17, minute=30)],
+}
+# the scheme used for the timetable, can be overridden with --block-scheme
+block_scheme = "kit"
+
+# pick one appointment per course to be visited for the evaluation, so that
+# as few courses as possible are visited at the same time, and only show
+# that one in the timetable, can be set with --assign
+assign_visits = False
+# number of evaluator teams, more visits at the same time are avoided if
+# possible, 0 for no limit, can be set with --teams
+evaluator_teams = 0
+# among equally good visits, prefer buildings that are visited on the same
+# day anyway; the building is the part of the room name before the first "."
+assign_by_building = False
 
 font_family = "Liberation Sans"
 font_size_name = "12pt"
@@ -86,18 +171,58 @@ block_separator_appointments = "1pt solid #000000"
 # End of configuration options
 ###
 
-# rows, columns
-# TODO: change everything to row, column
-spreadsheet_timetable = SodsSpreadSheet(200, 20)
-
 output_comparison_col_exclude = 4
 output_comparison_col_uebung = 5
 output_comparison_col_praktikum = 6
 output_comparison_col_found_appointment = 7
 output_comparison_col_name_vvz = 8
 
+
+# all options of a run, by default the configuration options above
+# Config(term_id=7895, input_file="other.csv") overrides single options, so the
+# functions below can be used as a library without touching module globals
+class Config:
+
+    options = ["term_id", "eva_starttime_str", "eva_endtime_str", "eva_windows",
+               "input_file", "lecturers_file", "rooms_file", "output_file", "output_comparison_file", "output_formats",
+               "windows_summary_file", "window_processes", "watch_interval", "load_window_only", "show_course_of_studies",
+               "course_store_file", "json_directory", "decode_processes", "decode_chunk_size", "api_url", "fetch_concurrency", "fetch_rate_limit",
+               "fetch_retries", "fetch_backoff", "fetch_timeout", "fetch_redirects", "fetch_bulk", "api_bulk_url", "bulk_page_size", "bulk_max_pages", "cache_manifest_file", "cache_ttl",
+               "refresh_policy", "block_schemes", "block_scheme", "assign_visits", "evaluator_teams",
+               "assign_by_building", "font_family", "font_size_name",
+               "font_size", "font_size_header", "block_separator_border", "block_separator_appointments"]
+
+    def __init__(self, metrics=None, **options):
+        for name in self.options:
+            value = globals()[name]
+            # do not share lists and dicts with the module defaults
+            if isinstance(value, (list, dict)):
+                value = type(value)(value)
+            setattr(self, name, value)
+        for name, value in options.items():
+            if name not in self.options:
+                raise TypeError("unknown configuration option '{0}'".format(name))
+            setattr(self, name, value)
+        # times and counters of everything that is done with this
+        # configuration
+        self.metrics = metrics if metrics is not None else Metrics()
+
+    # intervals for which a timetable is generated, as pairs of datetimes
+    def windows(self):
+        windows = [(parse_window_time(start), parse_window_time(end, True)) for start, end in self.eva_windows]
+        if not windows:
+            windows = [(parse_datetime(self.eva_starttime_str), parse_datetime(self.eva_endtime_str))]
+        return windows
+
+    def blocks(self):
+        return get_block_scheme(self.block_scheme, self.block_schemes)
+
+# Course and Appointment use __slots__, a whole term of them is kept in memory
 class Course:
 
+    __slots__ = ("id", "lvnr", "name", "name_short", "category", "lecturers", "appointments", "appointment_starts",
+                 "lecturers_rendered", "rooms_rendered")
+
     def __init__(self, id, lvnr, name, lecturers):
         self.id = int(id)
         self.lvnr = int(lvnr)
@@ -105,121 +230,885 @@ class Course:
         self.name_short = ""
         self.category = ""
         # TODO: rename to lecturers
-        self.lecturers = [_.strip() for _ in lecturers.split(",")]
-        # all occurrences over the whole semester
+        # interned, as the same lecturers teach many courses
+        self.lecturers = [sys.intern(_.strip()) for _ in lecturers.split(",")]
+        # all occurrences over the whole semester, sorted by start time
         self.appointments = []
-        # just occurrences within the time frame, containing a list of
-        # [weekday, block] pairs
-        # TODO: choose a better name
-        self.occurrences = []
+        # start times of self.appointments, built on the first window query
+        self.appointment_starts = None
+        # aliases of the lecturers joined for the timetable, and the alias of
+        # each room, set by update_aliases
+        self.lecturers_rendered = None
+        self.rooms_rendered = None
+
+    # return the appointments starting after start and before end, found by
+    # binary search in the sorted list of appointments
+    def appointments_between(self, start, end):
+        if self.appointment_starts is None or len(self.appointment_starts) != len(self.appointments):
+            self.appointment_starts = [appointment.start for appointment in self.appointments]
+        first = bisect_right(self.appointment_starts, start)
+        last = bisect_left(self.appointment_starts, end, first)
+        return self.appointments[first:last]
 
 
 class Appointment:
 
+    __slots__ = ("start", "end", "room")
+
     def __init__(self, start, end, room):
         self.start = start
         self.end = end
         self.room = room
 
-    def is_within_eva_period(self):
-        return self.start > eva_starttime and self.start < eva_endtime
 
-    def get_timetable_block(self):
-        count = len(timetable_blocks)
-        for i in range(0, count):
-            # if event starts later than the last block starts, assign it to
-            # the last block
-            if self.start.time() >= timetable_blocks[i]['time'] and (i == count - 1 or self.start.time() < timetable_blocks[i + 1]['time']):
-                return timetable_blocks[i]['block']
+# maps a time of day to the number of its block with a table holding the
+# block of each minute of the day
+class BlockScheme:
 
+    def __init__(self, name, start_times):
+        if len(start_times) == 0 or len(start_times) > 255:
+            raise ValueError("block scheme '{0}' needs between 1 and 255 blocks".format(name))
+        self.name = name
+        self.start_times = sorted(start_times)
+        self.count = len(self.start_times)
+        starts = [start_time.hour * 60 + start_time.minute for start_time in self.start_times]
+        # events before the first block are assigned to the first block, if
+        # an event starts later than the last block starts, assign it to the
+        # last block
+        table = bytearray(24 * 60)
+        for i, start in enumerate(starts):
+            end = starts[i + 1] if i + 1 < self.count else len(table)
+            table[start:end] = bytes([i + 1]) * (end - start)
+        table[:starts[0]] = bytes([1]) * starts[0]
+        self.table = bytes(table)
+
+    # block number, starting with 1, of a datetime or time
+    def block(self, moment):
+        return self.table[moment.hour * 60 + moment.minute]
+
+    # all block numbers of the scheme
+    def blocks(self):
+        return range(1, self.count + 1)
+
+
+def get_block_scheme(name, schemes=None):
+    if schemes is None:
+        schemes = block_schemes
+    if name not in schemes:
+        raise ValueError("unknown block scheme '{0}', choose one of: {1}".format(name, ", ".join(schemes)))
+    return BlockScheme(name, schemes[name])
+
+
+class FetchError(Exception):
+
+    def __init__(self, reason, retry=False):
+        super().__init__(reason)
+        self.reason = reason
+        # whether it makes sense to try again, e.g. after a timeout
+        self.retry = retry
+
+
+# spaces the requests to each host at least 1/rate seconds apart
+class HostRateLimiter:
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, host):
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = monotonic()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+        if slot > now:
+            sleep(slot - now)
+
+
+# keeps all downloaded courses and their appointments in an SQLite database,
+# together with fetch time, ETag, Last-Modified and a hash of the content
+class CourseStore:
+
+    def __init__(self, filename):
+        import sqlite3
+
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread=False)
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS courses (
+                term_id INTEGER NOT NULL,
+                lvnr INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                lecturer TEXT NOT NULL,
+                fetched REAL,
+                etag TEXT,
+                last_modified TEXT,
+                sha256 TEXT,
+                PRIMARY KEY (term_id, lvnr)
+            );
+            CREATE TABLE IF NOT EXISTS appointments (
+                term_id INTEGER NOT NULL,
+                lvnr INTEGER NOT NULL,
+                start TEXT NOT NULL,
+                end TEXT NOT NULL,
+                weekday INTEGER NOT NULL,
+                room TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS appointments_course ON appointments (term_id, lvnr, start);
+            CREATE INDEX IF NOT EXISTS appointments_start ON appointments (term_id, start);
+            CREATE INDEX IF NOT EXISTS appointments_weekday ON appointments (term_id, weekday, start);
+            CREATE INDEX IF NOT EXISTS appointments_room ON appointments (term_id, room);
+            """)
+
+    # return a dict with fetched, etag, last_modified and sha256 of a course
+    # or None if it is not in the store
+    def get_entry(self, term, course_lvnr):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT fetched, etag, last_modified, sha256 FROM courses WHERE term_id = ? AND lvnr = ?",
+                (term, int(course_lvnr))).fetchone()
+        if row is None:
+            return None
+        return {'fetched': row[0], 'etag': row[1], 'last_modified': row[2], 'sha256': row[3]}
+
+    # mark a course as up to date without changing its content, the etag and
+    # last_modified that are given replace the stored ones
+    def touch(self, term, course_lvnr, fetched, etag=None, last_modified=None):
+        with self.lock, self.connection:
+            self.connection.execute("UPDATE courses SET fetched = ?, etag = COALESCE(?, etag), "
+                                    "last_modified = COALESCE(?, last_modified) WHERE term_id = ? AND lvnr = ?",
+                                    (fetched, etag, last_modified, term, int(course_lvnr)))
+
+    # store the decoded API reply for a course, replacing an older version
+    def put(self, term, course_lvnr, data, fetched, etag=None, last_modified=None, content_hash=None):
+        self.put_many(term, [(course_lvnr, data, fetched, etag, last_modified, content_hash)])
+
+    # store several courses given as tuples of the arguments of put after
+    # term in one transaction; courses with the same content_hash as the
+    # stored version are only marked as up to date
+    # return the LVNRs of the courses that were replaced
+    def put_many(self, term, entries):
+        return self.put_records(term, [(course_lvnr, course_record(course_lvnr, data), fetched, etag, last_modified, content_hash)
+                                       for course_lvnr, data, fetched, etag, last_modified, content_hash in entries])
+
+    # like put_many, but with courses already decoded by course_record
+    def put_records(self, term, entries):
+        rows = []
+        for course_lvnr, ((id, name, lecturer), appointments), fetched, etag, last_modified, content_hash in entries:
+            rows.append(((term, int(course_lvnr), id, name, lecturer, fetched, etag, last_modified, content_hash),
+                         [(term, int(course_lvnr)) + appointment for appointment in appointments]))
+        replaced = []
+        with self.lock, self.connection:
+            for course, appointments in rows:
+                term, course_lvnr, fetched, content_hash = course[0], course[1], course[5], course[8]
+                if content_hash is not None:
+                    stored = self.connection.execute("SELECT sha256 FROM courses WHERE term_id = ? AND lvnr = ?",
+                                                     (term, course_lvnr)).fetchone()
+                    if stored is not None and stored[0] == content_hash:
+                        self.connection.execute("UPDATE courses SET fetched = ? WHERE term_id = ? AND lvnr = ?",
+                                                (fetched, term, course_lvnr))
+                        continue
+                self.connection.execute("DELETE FROM appointments WHERE term_id = ? AND lvnr = ?", (term, course_lvnr))
+                self.connection.execute("INSERT OR REPLACE INTO courses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", course)
+                self.connection.executemany("INSERT INTO appointments VALUES (?, ?, ?, ?, ?, ?)", appointments)
+                replaced.append(course_lvnr)
+        return replaced
+
+    # load the courses with the given LVNRs, return a dict with the LVNR as key;
+    # if starttime and endtime are given, only the appointments in between
+    # are loaded
+    def load_courses(self, term, course_numbers, starttime=None, endtime=None):
+        courses = {}
+        query = "SELECT lvnr, start, end, room FROM appointments JOIN wanted USING (lvnr) WHERE term_id = ?"
+        parameters = (term,)
+        if starttime is not None:
+            # stored like isoformat, so the strings compare like the datetimes
+            query += " AND start > ? AND start < ?"
+            parameters += (starttime.isoformat(sep=' '), endtime.isoformat(sep=' '))
+        with self.lock, self.connection:
+            self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (lvnr INTEGER PRIMARY KEY)")
+            self.connection.execute("DELETE FROM wanted")
+            self.connection.executemany("INSERT OR IGNORE INTO wanted VALUES (?)",
+                                        [(int(course_lvnr),) for course_lvnr in course_numbers])
+            for lvnr, id, name, lecturer in self.connection.execute(
+                    "SELECT lvnr, id, name, lecturer FROM courses JOIN wanted USING (lvnr) WHERE term_id = ?", (term,)):
+                courses[lvnr] = Course(id, lvnr, name, lecturer)
+            # the same timestamps appear in many courses, convert each only once
+            parsed = {}
+            # rows come sorted by start time from the index
+            for lvnr, start, end, room in self.connection.execute(query + " ORDER BY lvnr, start", parameters):
+                if start not in parsed:
+                    parsed[start] = datetime.fromisoformat(start)
+                if end not in parsed:
+                    parsed[end] = datetime.fromisoformat(end)
+                courses[lvnr].appointments.append(Appointment(parsed[start], parsed[end], sys.intern(room)))
+        return courses
+
+    # import JSON files written by earlier versions of this script, for
+    # courses that are not yet in the store, decoded by processes processes
+    # in chunks of chunk_size files
+    def import_directory(self, directory, term, manifest_name=cache_manifest_file, processes=1,
+                         chunk_size=decode_chunk_size):
+        if not os.path.isdir(directory):
+            return
+        manifest = {}
+        manifest_file = os.path.join(directory, manifest_name)
+        if os.path.isfile(manifest_file):
+            with open(manifest_file, 'r') as f:
+                manifest = json.load(f)
+        with self.lock:
+            known = {row[0] for row in self.connection.execute("SELECT lvnr FROM courses WHERE term_id = ?", (term,))}
+        filenames = []
+        for filename in sorted(glob.glob(os.path.join(directory, "*.json"))):
+            name = os.path.splitext(os.path.basename(filename))[0]
+            if name.isdigit() and int(name) not in known:
+                filenames.append(filename)
+        entries = []
+        for filename, record in zip(filenames, decode_course_files(filenames, processes, chunk_size)):
+            if record is None:
+                print("ERROR: Could not import {0}.".format(filename))
+                continue
+            name = os.path.splitext(os.path.basename(filename))[0]
+            entry = manifest.get(name, {})
+            entries.append((name, record, entry.get('fetched', os.path.getmtime(filename)),
+                            entry.get('etag'), entry.get('last_modified'), None))
+        imported = len(self.put_records(term, entries))
+        if imported > 0:
+            print("Imported {0} courses from {1} into {2}.".format(imported, directory, self.filename))
+
+    def close(self):
+        self.connection.close()
+
+
+# decode the reply of the API for a course into a compact record: its id, name
+# and lecturer, and its appointments as (start, end, weekday, room) in the
+# format of the course store, sorted by start
+def course_record(course_lvnr, data):
+    if not isinstance(data, list) or len(data) == 0:
+        raise ValueError("no course in reply")
+    if len(data) > 1:
+        print("WARNING: There is more than 1 object encoded for course {0}. Please have a look. For now, I only import the first.".format(course_lvnr))
+    obj = data[0]
+    appointments = [(appointment.start.isoformat(sep=' '), appointment.end.isoformat(sep=' '),
+                     appointment.start.isoweekday(), appointment.room)
+                    for appointment in course_parse_appointments(obj['dates'])]
+    return (int(obj['id']), obj['name'], obj['lecturer']), appointments
 
-# download data of all courses into subdirectory
-def get_courses(course_numbers):
-    for course_number in course_numbers:
-        get_course(course_number)
 
+# read a JSON file of a course named after its LVNR and return its record, or
+# None if it cannot be decoded
+def decode_course_file(filename):
+    try:
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        return course_record(os.path.splitext(os.path.basename(filename))[0], data)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+# decode JSON files of courses, with processes processes working on chunks of
+# chunk_size files each; the records are returned in the order of filenames
+def decode_course_files(filenames, processes=1, chunk_size=decode_chunk_size):
+    if processes > 1 and len(filenames) > chunk_size:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(decode_course_file, filenames, chunksize=chunk_size))
+    return [decode_course_file(filename) for filename in filenames]
+
+
+# downloads courses with a pool of threads, each thread keeps its own
+# keep-alive connection per host
+class CourseFetcher:
+
+    def __init__(self, store, config):
+        self.store = store
+        self.term_id = config.term_id
+        self.url = config.api_url
+        self.refresh = config.refresh_policy
+        self.ttl = config.cache_ttl
+        self.concurrency = config.fetch_concurrency
+        self.retries = config.fetch_retries
+        self.backoff = config.fetch_backoff
+        self.timeout = config.fetch_timeout
+        self.redirects = config.fetch_redirects
+        self.bulk_url = config.api_bulk_url
+        self.page_size = config.bulk_page_size
+        self.max_pages = config.bulk_max_pages
+        self.rate_limiter = HostRateLimiter(config.fetch_rate_limit)
+        self.local = threading.local()
+
+    def connection(self, scheme, host):
+        import http.client
+
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        key = (scheme, host)
+        if key not in self.local.connections:
+            if scheme == "https":
+                self.local.connections[key] = http.client.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                self.local.connections[key] = http.client.HTTPConnection(host, timeout=self.timeout)
+        return self.local.connections[key]
+
+    def drop_connection(self, scheme, host):
+        connection = self.local.connections.pop((scheme, host), None)
+        if connection is not None:
+            connection.close()
+
+    # send one GET request, return the response and its body
+    def request(self, url, headers={}):
+        with self.open(url, headers) as response:
+            body = response.read()
+        return response, body
+
+    # drop the connection to the host of parts on errors, the server may have
+    # closed an idle connection, so the next request starts with a fresh one
+    @contextmanager
+    def using_connection(self, parts):
+        import http.client
+
+        try:
+            yield self.connection(parts.scheme, parts.netloc)
+        except (http.client.HTTPException, OSError) as err:
+            self.drop_connection(parts.scheme, parts.netloc)
+            raise FetchError(str(err) or type(err).__name__, retry=True)
+        except BaseException:
+            self.drop_connection(parts.scheme, parts.netloc)
+            raise
+
+    # send one GET request and yield the response, whose body can then be
+    # read in chunks; redirects are followed at most self.redirects times
+    @contextmanager
+    def open(self, url, headers={}):
+        import urllib.parse
+
+        for redirect in range(self.redirects + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+            self.rate_limiter.wait(parts.netloc)
+            with self.using_connection(parts) as connection:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                location = response.getheader('Location')
+                if response.status not in (301, 302, 303, 307, 308) or location is None:
+                    break
+                # the body has to be read before the connection can be used
+                # again
+                response.read()
+            if response.will_close:
+                self.drop_connection(parts.scheme, parts.netloc)
+            url = urllib.parse.urljoin(url, location)
+            verbose("follow redirect to '{0}'.".format(url))
+        else:
+            raise FetchError("more than {0} redirects".format(self.redirects))
+
+        with self.using_connection(parts):
+            yield response
+            # the rest of the body has to be read before the connection can
+            # be used again
+            response.read()
+        if response.will_close:
+            self.drop_connection(parts.scheme, parts.netloc)
+
+    # request url and retry with exponential backoff on temporary errors
+    def request_with_retry(self, url, headers={}):
+        attempt = 0
+        while True:
+            try:
+                response, body = self.request(url, headers)
+                if response.status == 429 or response.status >= 500:
+                    raise FetchError("HTTP {0} {1}".format(response.status, response.reason), retry=True)
+                return response, body
+            except FetchError as err:
+                if not err.retry or attempt >= self.retries:
+                    raise
+                verbose("retry {0} for '{1}': {2}".format(attempt + 1, url, err.reason))
+                sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+
+    # check if a downloaded course has to be revalidated
+    def needs_refresh(self, entry):
+        if self.refresh == "all":
+            return True
+        if self.refresh == "none":
+            return False
+        return entry['fetched'] is None or timestamp() - entry['fetched'] > self.ttl
+
+    # download data of one course into the store
+    # return "cached", "not modified" or "fetched", raise FetchError if it
+    # failed
+    def fetch(self, course_lvnr):
+        import hashlib
+
+        term_id = self.term_id
+        entry = self.store.get_entry(term_id, course_lvnr)
+        headers = {}
+        if entry is not None:
+            if not self.needs_refresh(entry):
+                verbose("course {0} already downloaded.".format(course_lvnr))
+                return "cached"
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+            verbose("revalidate course '{0}'.".format(course_lvnr))
+        else:
+            verbose("fetch course '{0}'.".format(course_lvnr))
+
+        response, body = self.request_with_retry(self.url.format(term_id, course_lvnr), headers)
+        fetched = timestamp()
+        if response.status == 304 and entry is not None:
+            self.store.touch(term_id, course_lvnr, fetched, response.getheader('ETag'), response.getheader('Last-Modified'))
+            return "not modified"
+        if response.status != 200:
+            raise FetchError("HTTP {0} {1}".format(response.status, response.reason))
+        try:
+            data = json.loads(body.decode('utf8'))
+        except ValueError:
+            raise FetchError("could not parse content as JSON")
+
+        content_hash = hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest()
+        # servers without ETag support send the whole course again, only
+        # replace the stored course if something changed
+        if entry is not None and entry['sha256'] == content_hash:
+            # keep the validators of the reply, or the server would never
+            # answer with 304 once it sends new ones
+            self.store.touch(term_id, course_lvnr, fetched, response.getheader('ETag'), response.getheader('Last-Modified'))
+            return "not modified"
+        try:
+            self.store.put(term_id, course_lvnr, data, fetched, response.getheader('ETag'),
+                           response.getheader('Last-Modified'), content_hash)
+        except (ValueError, KeyError, TypeError) as err:
+            raise FetchError("unexpected content: {0}".format(err))
+        return "fetched"
+
+    # download all courses, return a dict with course_lvnr as key and the
+    # result of fetch or the FetchError as value
+    def fetch_all(self, course_numbers):
+        from concurrent.futures import ThreadPoolExecutor
+
+        course_numbers = list(dict.fromkeys(course_numbers))
+        results = {}
+
+        def worker(course_lvnr):
+            try:
+                results[course_lvnr] = self.fetch(course_lvnr)
+            except FetchError as err:
+                results[course_lvnr] = err
+            except Exception as err:
+                results[course_lvnr] = FetchError("unexpected error: {0!r}".format(err))
+
+        with ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as executor:
+            list(executor.map(worker, course_numbers))
+        return {course_lvnr: results[course_lvnr] for course_lvnr in course_numbers}
+
+    # check if any of the courses is missing in the store or has to be
+    # revalidated, so that the listing of the term is worth downloading
+    def needs_term(self, course_numbers):
+        for course_lvnr in course_numbers:
+            entry = self.store.get_entry(self.term_id, course_lvnr)
+            if entry is None or self.needs_refresh(entry):
+                return True
+        return False
+
+    # download the listing of all courses of the term page by page into the
+    # store, return a dict with the LVNR of each course in the listing as
+    # key and "fetched" or "not modified" as value, and the number of
+    # requests
+    def fetch_term(self):
+        results = {}
+        page = 1
+        while True:
+            attempt = 0
+            known = len(results)
+            while True:
+                try:
+                    count = self.fetch_page(page, results)
+                    break
+                except FetchError as err:
+                    if not err.retry or attempt >= self.retries:
+                        raise
+                    verbose("retry {0} for page {1} of term {2}: {3}".format(attempt + 1, page, self.term_id, err.reason))
+                    sleep(self.backoff * 2 ** attempt)
+                    attempt += 1
+            if count < self.page_size:
+                return results, page
+            # a server that ignores page sends the same courses again
+            if len(results) == known:
+                verbose("page {0} of term {1} has no new courses, stop.".format(page, self.term_id))
+                return results, page
+            if page >= self.max_pages:
+                print("WARNING: stopped after {0} pages of the listing of term {1}.".format(page, self.term_id))
+                return results, page
+            page += 1
+
+    # download one page of the listing of the term and store its courses in
+    # batches while the reply is read, return the number of courses on it
+    def fetch_page(self, page, results, batch_size=200):
+        import hashlib
+
+        verbose("fetch page {0} of term {1}.".format(page, self.term_id))
+        count = 0
+        batch = {}
+
+        def store_batch():
+            fetched = timestamp()
+            entries = [(course_lvnr, data, fetched, None, None,
+                        hashlib.sha256(json.dumps(data, sort_keys=True).encode('utf8')).hexdigest())
+                       for course_lvnr, data in batch.items()]
+            try:
+                replaced = set(self.store.put_many(self.term_id, entries))
+            except (ValueError, KeyError, TypeError) as err:
+                raise FetchError("unexpected content: {0}".format(err))
+            for course_lvnr in batch:
+                results[course_lvnr] = "fetched" if course_lvnr in replaced else "not modified"
+            batch.clear()
+
+        with self.open(self.bulk_url.format(self.term_id, page, self.page_size)) as response:
+            # there are no more pages
+            if response.status == 404 and page > 1:
+                return 0
+            if response.status == 429 or response.status >= 500:
+                raise FetchError("HTTP {0} {1}".format(response.status, response.reason), retry=True)
+            if response.status != 200:
+                raise FetchError("HTTP {0} {1}".format(response.status, response.reason))
+            try:
+                for obj in iter_json_array(iter(lambda: response.read(64 * 1024), b"")):
+                    count += 1
+                    course_lvnr = str(obj.get('no', "")) if isinstance(obj, dict) else ""
+                    if not course_lvnr.isdigit():
+                        verbose("skip entry {0} on page {1} without LVNR.".format(count, page))
+                        continue
+                    batch.setdefault(int(course_lvnr), []).append(obj)
+                    if len(batch) >= batch_size:
+                        store_batch()
+            except ValueError as err:
+                raise FetchError("could not parse content as JSON: {0}".format(err))
+        if batch:
+            store_batch()
+        return count
+
+
+# yield the elements of a JSON array of objects, like the listings of the
+# API, read from chunks of bytes; only one element is decoded at a time, not
+# the whole array
+def iter_json_array(chunks):
+    import codecs
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf8')()
+    chunks = iter(chunks)
+    buffer = ""
+    position = 0
+    # what comes next: "[", "element", "element or end" or "separator"
+    expected = "["
+    exhausted = False
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n":
+            position += 1
+        if position < len(buffer):
+            char = buffer[position]
+            if expected == "[":
+                if char != "[":
+                    raise ValueError("expected a JSON array")
+                position += 1
+                expected = "element or end"
+                continue
+            if char == "]" and expected != "element":
+                return
+            if expected == "separator":
+                if char != ",":
+                    raise ValueError("expected ',' or ']' at character {0}".format(position))
+                position += 1
+                expected = "element"
+                continue
+            try:
+                element, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # the element may go on in the next chunk
+                if exhausted:
+                    raise
+            else:
+                # a number may go on in the next chunk, also after a prefix
+                # that is a number of its own, like "-350" of "-350000.0"
+                number = char in "-0123456789"
+                if exhausted or (end < len(buffer) and not (number and buffer[end] in "0123456789.eE+-")):
+                    yield element
+                    position = end
+                    expected = "separator"
+                    continue
+        elif exhausted:
+            raise ValueError("JSON array ends unexpectedly")
+        chunk = next(chunks, None)
+        if chunk is None:
+            exhausted = True
+            chunk_text = utf8.decode(b"", final=True)
+        else:
+            chunk_text = utf8.decode(chunk)
+        buffer = buffer[position:] + chunk_text
+        position = 0
+
+
+# download data of all courses into the store and print a summary
+# return the set of courses which could not be downloaded
+def get_courses(store, course_numbers, config, fetcher=None):
+    if fetcher is None:
+        fetcher = CourseFetcher(store, config)
+    results = {}
+    if config.fetch_bulk and fetcher.needs_term(course_numbers):
+        try:
+            listing, requests = fetcher.fetch_term()
+            print("Fetched the listing of term {0}: {1} courses in {2} requests.".format(config.term_id, len(listing), requests))
+            config.metrics.count("bulk_requests", requests)
+            config.metrics.count("bulk_courses", len(listing))
+            results = {course_lvnr: listing[int(course_lvnr)] for course_lvnr in course_numbers if int(course_lvnr) in listing}
+        except FetchError as err:
+            print("ERROR: could not fetch the listing of term {0}: {1}, fetching single courses instead.".format(config.term_id, err.reason))
+    # courses that are not in the listing are fetched one by one
+    results.update(fetcher.fetch_all([course_lvnr for course_lvnr in course_numbers if course_lvnr not in results]))
+    failed = {lvnr: err for lvnr, err in results.items() if isinstance(err, FetchError)}
+    fetched = sum(1 for result in results.values() if result == "fetched")
+    not_modified = sum(1 for result in results.values() if result == "not modified")
+    cached = sum(1 for result in results.values() if result == "cached")
+    print("Fetched {0} courses, {1} unchanged, {2} already downloaded, {3} failed.".format(fetched, not_modified, cached, len(failed)))
+    config.metrics.count("cache_misses", fetched)
+    config.metrics.count("cache_revalidated", not_modified)
+    config.metrics.count("cache_hits", cached)
+    config.metrics.count("fetch_failed", len(failed))
+    for course_lvnr, err in failed.items():
+        print("ERROR: could not fetch course '{0}': {1}".format(course_lvnr, err.reason))
+    return set(failed)
+
+
+# holds the courses within one time interval, sorted by weekday and block
+class Timetable:
+
+    # the timetable covers Monday to Friday
+    weekdays = range(1, 6)
+
+    def __init__(self, starttime, endtime, blocks):
+        self.starttime = starttime
+        self.endtime = endtime
+        self.blocks = blocks
+        # holds one cell per weekday and block, Monday's blocks first, and
+        # within each cell the appointments of each course
+        self.grid = [{} for _ in range(len(self.weekdays) * blocks.count)]
+        # occurrences of each course within the time frame, containing a
+        # tuple of (weekday, block) pairs
+        self.occurrences = {}
+        # holds courses for which no appointment was found within the time
+        # interval
+        self.missed = {}
+        # set by pick_visits: the largest number of visits at the same time,
+        # the number before visits were assigned and the number of times
+        # there are more visits than teams
+        self.visits = None
+
+    def index(self, weekday, block):
+        return (weekday - 1) * self.blocks.count + block - 1
+
+    # appointments of each course in one block of one weekday
+    def cell(self, weekday, block):
+        return self.grid[(weekday - 1) * self.blocks.count + block - 1]
+
+    # (weekday, block) of every cell
+    def cells(self):
+        return [(weekday, block) for weekday in self.weekdays for block in self.blocks.blocks()]
+
+    def appointment_count(self):
+        return sum(len(appointments) for cell in self.grid for appointments in cell.values())
+
+    # get maximum number of lectures that has to be fit into each block
+    def block_load(self):
+        return {block: max(len(self.cell(weekday, block)) for weekday in self.weekdays) for block in self.blocks.blocks()}
+
+    # same as block_load, but set it to 1 at least
+    def block_height(self):
+        return {block: max(1, load) for block, load in self.block_load().items()}
+
+    # sort the appointments of a course within the time interval into the
+    # timetable, return its (weekday, block) pairs
+    def add_course(self, course):
+        course_lvnr = course.lvnr
+        grid = self.grid
+        block_count = self.blocks.count
+        block_of = self.blocks.block
+        last_weekday = len(self.weekdays)
+        # (weekday, block) pairs in the order they occur, a dict serves as
+        # ordered set
+        occurrences = {}
+        # iterate over the events within the time interval only
+        for appointment in course.appointments_between(self.starttime, self.endtime):
+            # get information about position in timetable
+            weekday = appointment.start.isoweekday()
+            if weekday > last_weekday:
+                continue
+            block = block_of(appointment.start)
+
+            # append the date to the list of dates in the timetable
+            cell = grid[(weekday - 1) * block_count + block - 1]
+            if course_lvnr not in cell:
+                cell[course_lvnr] = [appointment]
+                occurrences[(weekday, block)] = None
+            else:
+                cell[course_lvnr].append(appointment)
 
-# download data in json format of one course to a file
-def get_course(course_lvnr):
-    if os.path.isfile("{0}/{1}.json".format(json_directory, course_lvnr)):
-        verbose("course {0} already downloaded.".format(course_lvnr))
+        if occurrences:
+            self.occurrences[course_lvnr] = tuple(occurrences)
+        else:
+            self.missed[course_lvnr] = course
+        return tuple(occurrences)
+
+    # take a course out of the timetable, return its (weekday, block) pairs
+    def remove_course(self, course_lvnr):
+        occurrences = self.occurrences.pop(course_lvnr, ())
+        for weekday, block in occurrences:
+            del self.cell(weekday, block)[course_lvnr]
+        self.missed.pop(course_lvnr, None)
+        return occurrences
+
+    # restore the order of the courses given by position in the given
+    # (weekday, block) cells and in the missed courses
+    def sort(self, position, cells):
+        for weekday, block in cells:
+            index = self.index(weekday, block)
+            cell = self.grid[index]
+            self.grid[index] = {course_lvnr: cell[course_lvnr] for course_lvnr in sorted(cell, key=position.get)}
+        self.missed = {course_lvnr: self.missed[course_lvnr] for course_lvnr in sorted(self.missed, key=position.get)}
+
+
+def build_timetable(courses, starttime, endtime, blocks, metrics=None):
+    return build_timetables(courses, [(starttime, endtime)], blocks, metrics)[0]
+
+
+# sort the courses into one timetable per interval, going over the courses
+# only once, so they can come from a generator; courses is a dict or an
+# iterable of courses; the time and counts are recorded in metrics, if given
+def build_timetables(courses, windows, blocks, metrics=None):
+    if isinstance(courses, dict):
+        courses = courses.values()
+    if metrics is None:
+        metrics = Metrics()
+    appointments_loaded = 0
+    with metrics.phase("build_timetable", hot=True):
+        timetables = [Timetable(starttime, endtime, blocks) for starttime, endtime in windows]
+        # iterate over all courses
+        for course in courses:
+            appointments_loaded += len(course.appointments)
+            for timetable in timetables:
+                timetable.add_course(course)
+    metrics.count("appointments_loaded", appointments_loaded)
+    for timetable in timetables:
+        metrics.count("courses_in_timetable", len(timetable.occurrences))
+        metrics.count("courses_missed", len(timetable.missed))
+        metrics.count("appointments_in_window", timetable.appointment_count())
+    return timetables
+
+
+# pick one appointment of each course of the timetable to be visited and
+# return a timetable with only these appointments
+# the visits are spread so that as few as possible take place on the same
+# day in the same block: courses with the fewest appointments are assigned
+# first, each to its least busy slot, then courses are moved to less busy
+# slots as long as that helps; with teams, slots with more visits than
+# teams are avoided first
+def pick_visits(timetable, teams=0, by_building=False, passes=20, metrics=None):
+    if metrics is None:
+        metrics = Metrics()
+    with metrics.phase("pick_visits", hot=True):
+        # appointments of each course within the interval as (weekday, block,
+        # appointment), in the order of the timetable
+        options = {course_lvnr: [(weekday, block, appointment) for weekday, block in cells
+                                 for appointment in timetable.cell(weekday, block)[course_lvnr]]
+                   for course_lvnr, cells in timetable.occurrences.items()}
+        # number of visits per (date, block) and per (date, building)
+        load = {}
+        buildings = {}
+        slots = {course_lvnr: [(appointment.start.date(), block) for weekday, block, appointment in course_options]
+                 for course_lvnr, course_options in options.items()}
+        places = {course_lvnr: [(appointment.start.date(), appointment.room.split(".")[0]) for weekday, block, appointment in course_options]
+                  for course_lvnr, course_options in options.items()}
+
+        # what it costs to add one more visit to option i of a course
+        def cost(course_lvnr, i):
+            visits = load.get(slots[course_lvnr][i], 0)
+            return (teams > 0 and visits >= teams, visits,
+                    by_building and buildings.get(places[course_lvnr][i], 0) == 0)
+
+        def add(course_lvnr, i, n):
+            slot = slots[course_lvnr][i]
+            load[slot] = load.get(slot, 0) + n
+            place = places[course_lvnr][i]
+            buildings[place] = buildings.get(place, 0) + n
+
+        # courses with few options first, ties are broken by the number, so
+        # the choice does not depend on the order the courses were added in
+        choice = {}
+        for course_lvnr in sorted(options, key=lambda course_lvnr: (len(options[course_lvnr]), course_lvnr)):
+            choice[course_lvnr] = min(range(len(options[course_lvnr])), key=lambda i: cost(course_lvnr, i))
+            add(course_lvnr, choice[course_lvnr], 1)
+
+        for _ in range(passes):
+            moved = 0
+            for course_lvnr, current in choice.items():
+                add(course_lvnr, current, -1)
+                best = min(range(len(options[course_lvnr])), key=lambda i: cost(course_lvnr, i))
+                if cost(course_lvnr, best) < cost(course_lvnr, current):
+                    choice[course_lvnr] = best
+                    moved += 1
+                add(course_lvnr, choice[course_lvnr], 1)
+            if moved == 0:
+                break
+
+        assigned = Timetable(timetable.starttime, timetable.endtime, timetable.blocks)
+        for course_lvnr in timetable.occurrences:
+            weekday, block, appointment = options[course_lvnr][choice[course_lvnr]]
+            assigned.cell(weekday, block)[course_lvnr] = [appointment]
+            assigned.occurrences[course_lvnr] = ((weekday, block),)
+        assigned.missed = dict(timetable.missed)
+
+    before = {}
+    for course_lvnr in options:
+        for slot in set(slots[course_lvnr]):
+            before[slot] = before.get(slot, 0) + 1
+    peak = max(load.values(), default=0)
+    assigned.visits = (peak, max(before.values(), default=0),
+                       sum(1 for visits in load.values() if visits > teams) if teams > 0 else 0)
+    metrics.maximum("visits_peak", peak)
+    return assigned
+
+
+# print the result of pick_visits, in the main process also for timetables
+# planned by worker processes
+def print_visits(config, timetable):
+    if timetable.visits is None:
         return
-    try:
-        print("fetch course '{0}'.".format(course_lvnr))
-
-        # use rest api to access data
-        response = urllib.request.urlopen(
-            "http://www.kithub.de/api/terms/{0}/events.json?type=detail&no={1}".format(term_id, course_lvnr)).readall().decode('utf8')
-        # TODO: catch exceptions for next line
-        data = json.loads(response)
-
-        if not os.path.exists(json_directory):
-            os.makedirs(json_directory)
-        with open("{0}/{1}.json".format(json_directory, course_lvnr), 'w') as file:
-            file.write(json.dumps(data, indent=2, sort_keys=True))
-
-    except urllib.error.URLError as err:
-        print("ERROR: URLError while fetching course '{0}': {1}".format(
-            course_lvnr, err.reason))
-    except urllib.error.HTTPError as err:
-        print("ERROR: HTTPError '{0}' while fetching course '{1}': {2}".format(
-            err.code, course_lvnr, err.reason))
-    except ValueError:
-        print("ERROR: ValueError while parsing content as JSON for course '{0}'.".format(
-            course_lvnr))
-    except:
-        print(
-                "ERROR: Unexpected error while fetching course '{0}': ".format(course_lvnr))
-        print(sys.exc_info()[0])
-
-
-def build_timetable():
-    # iterate over all courses
-    for course_lvnr, course in courses.items():
-        found_appointment = False
-        # iterate over all events
-        for appointment in course.appointments:
-            if appointment.is_within_eva_period():
-                found_appointment = True
-
-                # get information about position in timetable
-                weekday = appointment.start.isoweekday()
-                block = appointment.get_timetable_block()
-
-                # append the date to the list of dates in the timetable
-                if course_lvnr not in timetable[weekday][block]:
-                    timetable[weekday][block][course_lvnr] = []
-                timetable[weekday][block][course_lvnr].append(appointment)
-
-                # append this [weekday, block] to the list of occurrences
-                if [weekday, block] not in course.occurrences:
-                    course.occurrences.append([weekday, block])
-
-        if not found_appointment:
-            courses_missed[course.lvnr] = course
-
-
-def load_course_from_filesystem(filename):
-    with open(filename, 'r') as f:
-        data = json.load(f)
-    if len(data) > 1:
-        print(
-                "WARNING: There is more than 1 object encoded in file {0}. Please have a look. For now, I only import the first.".format(filename))
-    obj = data[0]
-    # TODO: check if it's a dictionary
-    course = Course(
-            obj['id'], obj['no'], obj['name'], obj['lecturer'])
-    course.appointments = course_parse_appointments(obj['dates'])
-    return course
+    peak, before, overloaded = timetable.visits
+    print("Visits assigned: at most {0} at the same time, instead of {1}.".format(peak, before))
+    if overloaded:
+        print("WARNING: {0} times more than {1} visits at the same time.".format(overloaded, config.evaluator_teams))
+
+
+# the timetable to render: the one given, or with one visit per course if
+# config.assign_visits is set
+def plan_visits(config, timetable):
+    if not config.assign_visits:
+        return timetable
+    return pick_visits(timetable, config.evaluator_teams, config.assign_by_building, metrics=config.metrics)
 
 
 # replace datetime in string format by an actual datetime object
 def course_parse_appointments(dates):
-    appointments = []
-    for date in dates:
-        appointment = Appointment(parse_datetime(
-            date["start_time"]), parse_datetime(date["end_time"]), date["room"])
-        appointments.append(appointment)
+    starts = parse_datetimes([date["start_time"] for date in dates])
+    ends = parse_datetimes([date["end_time"] for date in dates])
+    appointments = [Appointment(start, end, date["room"]) for start, end, date in zip(starts, ends, dates)]
     # sort the list by start date
     appointments.sort(key=lambda appointment: appointment.start)
     return appointments
@@ -232,33 +1121,299 @@ def parse_datetime(str):
     return datetime.strptime(str, datetime_format).replace(tzinfo=None)
 
 
-def verbose(str):
-    if verbose_output:
-        print(str)
+# already parsed timestamps, the same start and end times appear in many
+# courses and many weeks
+datetime_cache = {}
 
 
-def print_timetable(str):
-    if terminal_timetable:
-        print(str)
+# parse a list of timestamps of the kithub api at once, each distinct string
+# is only parsed once
+def parse_datetimes(strings):
+    cache = datetime_cache
+    result = []
+    for string in strings:
+        value = cache.get(string)
+        if value is None:
+            value = parse_datetime_fast(string)
+            cache[string] = value
+        result.append(value)
+    return result
+
 
-def column_name_from_number(column_number):
-    return spreadsheet_timetable.encodeColName(column_number)
+# parse the fixed format 2014-06-11T19:00:00+02:00 by slicing, fall back to
+# parse_datetime for anything else
+def parse_datetime_fast(string):
+    if (len(string) == 25 and string[4] == '-' and string[7] == '-' and string[10] == 'T'
+            and string[13] == ':' and string[16] == ':' and string[19] in '+-' and string[22] == ':'):
+        try:
+            # ignore timezones
+            return datetime(int(string[0:4]), int(string[5:7]), int(string[8:10]),
+                            int(string[11:13]), int(string[14:16]), int(string[17:19]))
+        except ValueError:
+            pass
+    return parse_datetime(string)
 
 
-def cell_coordinate(row_number, column_number):
-    return spreadsheet_timetable.encodeCellName(row_number, column_number)
+def verbose(str):
+    if verbose_output:
+        print(str)
+
+
+# wall time of each phase of a run and counters of what was done
+# hooks can be "cprofile" or "tracemalloc" to profile the phases marked as
+# hot, i.e. building the timetable and writing the ODS files
+class Metrics:
+
+    def __init__(self, hooks=None):
+        self.hooks = hooks
+        self.lock = threading.Lock()
+        # phase name -> seconds, in the order the phases were first entered
+        self.phases = {}
+        self.counters = {}
+        # values of which only the largest one is kept, like peaks
+        self.maxima = {}
+        # phase name -> peak memory in bytes, with hooks == "tracemalloc"
+        self.memory = {}
+        self.profile = None
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # metrics are sent to worker processes together with their configuration,
+    # without the lock and the profile, which cannot be pickled
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state['lock']
+        state['profile'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def maximum(self, name, value):
+        with self.lock:
+            self.maxima[name] = max(value, self.maxima.get(name, value))
+
+    # measure the time spent in a with block, phases entered several times
+    # are summed up
+    @contextmanager
+    def phase(self, name, hot=False):
+        hook = self.hooks if hot else None
+        if hook == "cprofile":
+            import cProfile
+
+            if self.profile is None:
+                self.profile = cProfile.Profile()
+            self.profile.enable()
+        elif hook == "tracemalloc":
+            import tracemalloc
+
+            tracemalloc.start()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            duration = perf_counter() - start
+            if hook == "cprofile":
+                self.profile.disable()
+            elif hook == "tracemalloc":
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                self.memory[name] = max(peak, self.memory.get(name, 0))
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0) + duration
+
+    # add the result of as_dict() of other metrics, e.g. of a worker process,
+    # times and counters are summed up, of maxima the larger one is kept
+    def merge(self, data):
+        with self.lock:
+            for name, duration in data['seconds'].items():
+                self.phases[name] = self.phases.get(name, 0) + duration
+            for name, value in data['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, value in data.get('maxima', {}).items():
+                self.maxima[name] = max(value, self.maxima.get(name, value))
+            for name, peak in data.get('peak_memory', {}).items():
+                self.memory[name] = max(peak, self.memory.get(name, 0))
+
+    def as_dict(self):
+        result = {'seconds': dict(self.phases), 'counters': dict(self.counters)}
+        if self.maxima:
+            result['maxima'] = dict(self.maxima)
+        if self.memory:
+            result['peak_memory'] = dict(self.memory)
+        return result
+
+    def print_summary(self):
+        print("Phase                      Time")
+        for name, duration in self.phases.items():
+            line = "{0:20} {1:10.1f} ms".format(name, duration * 1000)
+            if name in self.memory:
+                line += " {0:10.1f} KiB peak".format(self.memory[name] / 1024)
+            print(line)
+        print("{0:20} {1:10.1f} ms".format("total", sum(self.phases.values()) * 1000))
+        for name, value in list(self.counters.items()) + list(self.maxima.items()):
+            print("{0:27} {1}".format(name, value))
+        if self.profile is not None:
+            import pstats
+
+            print()
+            pstats.Stats(self.profile).sort_stats("cumulative").print_stats(25)
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+
+
+# writes a spreadsheet with a single table to an OpenDocument file
+# only the cells that are actually used are kept, cells with the same
+# formatting share one automatic style, and content.xml is streamed into the
+# zip file row by row
+class OdsWriter:
+
+    mimetype = "application/vnd.oasis.opendocument.spreadsheet"
+
+    manifest = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" manifest:version="1.2">
+ <manifest:file-entry manifest:full-path="/" manifest:version="1.2" manifest:media-type="application/vnd.oasis.opendocument.spreadsheet"/>
+ <manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>
+</manifest:manifest>
+"""
+
+    content_start = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0" office:version="1.2">
+"""
+
+    # attributes of set_style and where they belong in the style
+    cell_properties = {'border_top': 'fo:border-top', 'border_right': 'fo:border-right',
+                       'background_color': 'fo:background-color'}
+    text_properties = {'font_family': 'fo:font-family', 'font_size': 'fo:font-size'}
+
+    def __init__(self, sheet_name="Sheet1", metrics=None):
+        self.sheet_name = sheet_name
+        # records the number of cells and styles written, if given
+        self.metrics = metrics if metrics is not None else Metrics()
+        # row number -> column number -> [value, style attributes]
+        self.rows = {}
+        self.column_count = 0
+
+    def cell(self, row_number, column_number):
+        row = self.rows.get(row_number)
+        if row is None:
+            row = self.rows[row_number] = {}
+        cell = row.get(column_number)
+        if cell is None:
+            cell = row[column_number] = [None, None]
+            if column_number > self.column_count:
+                self.column_count = column_number
+        return cell
+
+    # content must be string
+    def set_value(self, row_number, column_number, content):
+        self.cell(row_number, column_number)[0] = content
+
+    def set_style(self, row_number, column_number, **style):
+        cell = self.cell(row_number, column_number)
+        if cell[1] is None:
+            cell[1] = style
+        else:
+            cell[1] = dict(cell[1], **style)
+
+    def set_range_style(self, first_row, first_column, last_row, last_column, **style):
+        for row_number in range(first_row, last_row + 1):
+            for column_number in range(first_column, last_column + 1):
+                self.set_style(row_number, column_number, **style)
+
+    @staticmethod
+    def style_key(style):
+        return tuple(sorted(style.items())) if style else None
+
+    def style_xml(self, name, key):
+        from xml.sax.saxutils import quoteattr
+
+        style = dict(key)
+        cell_properties = "".join(" {0}={1}".format(attribute, quoteattr(style[option]))
+                                  for option, attribute in self.cell_properties.items() if option in style)
+        text_properties = "".join(" {0}={1}".format(attribute, quoteattr(style[option]))
+                                  for option, attribute in self.text_properties.items() if option in style)
+        xml = '<style:style style:name="{0}" style:family="table-cell">'.format(name)
+        if cell_properties:
+            xml += "<style:table-cell-properties{0}/>".format(cell_properties)
+        if text_properties:
+            xml += "<style:text-properties{0}/>".format(text_properties)
+        return xml + "</style:style>\n"
+
+    def save(self, filename):
+        import zipfile
+        from xml.sax.saxutils import quoteattr
+
+        # collect the distinct formats, each of them becomes one style
+        style_names = {}
+        for row in self.rows.values():
+            for cell in row.values():
+                key = self.style_key(cell[1])
+                if key is not None and key not in style_names:
+                    style_names[key] = "ce{0}".format(len(style_names) + 1)
+
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as ods:
+            # the mimetype has to be the first file and must not be compressed
+            ods.writestr(zipfile.ZipInfo("mimetype"), self.mimetype, compress_type=zipfile.ZIP_STORED)
+            ods.writestr("META-INF/manifest.xml", self.manifest)
+            with ods.open("content.xml", 'w') as binary:
+                content = io.TextIOWrapper(binary, encoding='utf8')
+                content.write(self.content_start)
+                content.write("<office:automatic-styles>\n")
+                for key, name in style_names.items():
+                    content.write(self.style_xml(name, key))
+                content.write("</office:automatic-styles>\n")
+                content.write('<office:body><office:spreadsheet><table:table table:name={0}>\n'.format(quoteattr(self.sheet_name)))
+                content.write('<table:table-column table:number-columns-repeated="{0}"/>\n'.format(max(1, self.column_count)))
+                self.write_rows(content, style_names)
+                content.write("</table:table></office:spreadsheet></office:body></office:document-content>\n")
+                content.flush()
+                content.detach()
+        self.metrics.count("styles_written", len(style_names))
+
+    def write_rows(self, content, style_names):
+        from xml.sax.saxutils import escape
+
+        previous_row = 0
+        for row_number in sorted(self.rows):
+            if row_number > previous_row + 1:
+                content.write('<table:table-row table:number-rows-repeated="{0}"><table:table-cell/></table:table-row>\n'.format(row_number - previous_row - 1))
+            previous_row = row_number
+            parts = ["<table:table-row>"]
+            row = self.rows[row_number]
+            previous_column = 0
+            for column_number in sorted(row):
+                if column_number > previous_column + 1:
+                    parts.append('<table:table-cell table:number-columns-repeated="{0}"/>'.format(column_number - previous_column - 1))
+                previous_column = column_number
+                value, style = row[column_number]
+                key = self.style_key(style)
+                style_attribute = ' table:style-name="{0}"'.format(style_names[key]) if key is not None else ""
+                if value is None or value == "":
+                    parts.append("<table:table-cell{0}/>".format(style_attribute))
+                else:
+                    parts.append('<table:table-cell{0} office:value-type="string"><text:p>{1}</text:p></table:table-cell>'.format(
+                        style_attribute, escape(str(value))))
+            parts.append("</table:table-row>\n")
+            content.write("".join(parts))
+            self.metrics.count("cells_written", len(row))
 
 
 # content must be string
 def print_cell(spreadsheet, row_number, column_number, content, font_size=font_size, font_family=font_family):
-    spreadsheet.setValue(cell_coordinate(row_number, column_number), content)
-    spreadsheet.setStyle(cell_coordinate(row_number, column_number), font_family = font_family)
-    spreadsheet.setStyle(cell_coordinate(row_number, column_number), font_size = font_size)
+    spreadsheet.set_value(row_number, column_number, content)
+    spreadsheet.set_style(row_number, column_number, font_family=font_family, font_size=font_size)
 
 
-def print_row(spreadsheet, row_number, row):
+def print_row(spreadsheet, row_number, row, font_size=font_size, font_family=font_family):
     for i, cell in enumerate(row):
-        print_cell(spreadsheet, row_number, i+1, cell)
+        print_cell(spreadsheet, row_number, i+1, cell, font_size, font_family)
 
 def load_aliases_from_filesystem(filename):
     target = {}
@@ -282,237 +1437,903 @@ def load_aliases_from_filesystem(filename):
         verbose("Read {0} rooms from {1}".format(row_counter, filename))
     return target
 
-def write_aliases(filename, source):
-    # write alias file back to disk
-    with open(filename, 'w', newline='') as csvfile:
+def append_aliases(filename, names):
+    # add names without alias at the end of the alias file, start a new file
+    # with the header
+    new_file = not os.path.isfile(filename) or os.path.getsize(filename) == 0
+    missing_newline = False
+    if not new_file:
+        with open(filename, 'rb') as csvfile:
+            csvfile.seek(-1, os.SEEK_END)
+            missing_newline = csvfile.read(1) not in (b"\n", b"\r")
+    with open(filename, 'a', newline='') as csvfile:
+        if missing_newline:
+            csvfile.write("\r\n")
         csvwriter = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-        csvwriter.writerow(['Name', 'Alias'])
-        for name, alias in source.items():
-            if alias == name:
-                alias = ""
-            csvwriter.writerow([name, alias])
-
-
-# holds all courses as Course objects with course.lvnr as key
-courses = {}
-# holds courses for which no appointment was found within the time interval
-courses_missed = {}
-
-# holds aliases for rooms
-rooms = {}
-new_rooms = False
-# holds aliases for lecturers
-lecturers = {}
-new_lecturers = False
-
-eva_starttime = parse_datetime(eva_starttime_str)
-eva_endtime = parse_datetime(eva_endtime_str)
-
-print("Printing time interval {0} to {1}".format(eva_starttime, eva_endtime))
-
-with open(input_file, newline='') as csvfile:
-    spamreader = csv.reader(csvfile, delimiter=',', quotechar='"')
-    row_counter = 0
-    for row in spamreader:
-        if row_counter > 0 and row[output_comparison_col_exclude - 1] != "x":
-            get_course(row[0])
-            course = load_course_from_filesystem("{0}/{1}.json".format(json_directory, int(row[0])))
-            course.category = row[1]
-            course.name_short = row[2]
-            if row[output_comparison_col_uebung - 1] == "x":
-                course.name_short += " +Übung"
-            if row[output_comparison_col_praktikum - 1] == "x":
-                course.name_short += " +Prakt"
-            if show_course_of_studies and row[1] != "":
-                course.name_short += " ({0})".format(row[1])
-            courses[course.lvnr] = course
-        row_counter += 1
-
-lecturers = load_aliases_from_filesystem(lecturers_file)
-rooms = load_aliases_from_filesystem(rooms_file)
-
-# check if there are more lecturers
-for course in courses.values():
-    for lecturer in course.lecturers:
-        # add to list of lecturer aliases
-        if not lecturer in lecturers:
-            lecturers[lecturer] = lecturer
-            new_lecturers = True
-if new_lecturers:
-    verbose("Courses have lecturers that are not yet in {0}".format(lecturers_file))
-    write_aliases(lecturers_file, lecturers)
-
-# check if there are more rooms
-for course in courses.values():
-    for appointment in course.appointments:
-        # add to list of lecturer aliases
-        if not appointment.room in rooms:
-            rooms[appointment.room] = appointment.room
-            new_rooms = True
-if new_rooms:
-    verbose("Courses have rooms that are not yet in {0}".format(rooms_file))
-    write_aliases(rooms_file, rooms)
-
-
-spreadsheet_output_comparison = SodsSpreadSheet(row_counter, 10)
-
-# holds all days, and within them all blocks and within these the courses
-timetable = {}
-
-for day in range(1, 6):
-    blocks = {}
-    for block in range(1, 9):
-        blocks[block] = {}
-    timetable[day] = blocks
-
-# assemble the timetable
-build_timetable()
-
-# spreadsheet columns and rows start at 1, plus leave the first empty
-column_start = 2
-row_start = 3
-
-# number of columns and rows per entry
-appointment_width = 2
-appointment_height = 3
-
-# get maximum number of lectures that has to be fit into each block
-# but set it to 1 at least
-block_height = {}
-for block in range(1, 9):
-    block_height[block] = 1
-
-for block in range(1, 9):
-    for weekday in range(1, 6):
-        new_height = len(timetable[weekday][block])
-        if new_height > block_height[block]:
-            block_height[block] = new_height
-
-# print first column: block numbers
-current_row = row_start + 1
-for block in range(1, 9):
-    print_cell(spreadsheet_timetable, current_row, column_start, str(block))
-    current_row += block_height[block] * appointment_height
-
-# print timetable
-print_cell(spreadsheet_timetable, 1, column_start + 1, "Evaluation", font_size_header)
-print_cell(spreadsheet_timetable, 1, column_start + 4, "{0} bis {1}".format(eva_starttime.strftime("%d.%m."), eva_endtime.strftime("%d.%m.")), font_size_header)
-
-for weekday in range(1, 6):
-    print_timetable("{0}".format(weekdays[weekday]))
-    weekday_column = column_start + 1 + (weekday-1) * appointment_width
-    block_row_start = row_start + 1
-    print_cell(spreadsheet_timetable, row_start, weekday_column, weekdays[weekday], font_size_name)
-    for block in range(1, 9):
-        print_timetable("  {0}. Block".format(block))
-        for i, course_lvnr in enumerate(timetable[weekday][block].keys()):
-            course = courses[course_lvnr]
-            print_timetable("    {0}, {1}".format(course.name, ", ".join([lecturers[_] for _ in course.lecturers])))
-            course_row_start = block_row_start + i*appointment_height
-            print_cell(spreadsheet_timetable, course_row_start, weekday_column, course.name_short, font_size_name)
-            print_cell(spreadsheet_timetable, course_row_start + 1, weekday_column, ", ".join([lecturers[_] for _ in course.lecturers]))
-            course_rooms = []
-            course_dates = []
-            for appointment in timetable[weekday][block][course_lvnr]:
-                print_timetable("      {0}, {1}".format(appointment.start.strftime("%d.%m."), rooms[appointment.room]))
-                course_dates.append(appointment.start.strftime("%d.%m."))
-                if not rooms[appointment.room] in course_rooms:
-                    course_rooms.append(rooms[appointment.room])
-            course_other_dates = []
-            for weekday_other, block_other in course.occurrences:
-                if not (weekday_other == weekday and block_other == block):
-                    print_timetable(
-                        "      Auch {0}/{1}".format(weekdays_short[weekday_other], block_other))
-                    course_other_dates.append("{0}/{1}".format(weekdays_short[weekday_other], block_other))
-                    for appointment_other in timetable[weekday_other][block_other][course_lvnr]:
-                        print_timetable(
-                            "        {0}".format(appointment_other.start.strftime("%d.%m.")))
-            course_other_dates_str = ""
-            if len(course_other_dates) > 0:
-                course_other_dates_str = "; auch " + ", ".join(course_other_dates)
-            print_cell(spreadsheet_timetable, course_row_start, weekday_column + 1, ", ".join(course_rooms))
-            print_cell(spreadsheet_timetable, course_row_start + 2, weekday_column, ", ".join(course_dates) + course_other_dates_str)
-        block_row_start += block_height[block] * appointment_height
-
-
-# set borders on timetable
-
-# first the horizontal ones
-block_row_start = row_start + 1
-timetable_last_row = sum(block_height.values()) * appointment_height + block_row_start
-for row in range(block_row_start, timetable_last_row, 3):
-    spreadsheet_timetable.setStyle("{0}:{1}".format(cell_coordinate(row, column_start+1), cell_coordinate(row, 5*appointment_width + column_start)), border_top=block_separator_appointments)
-
-# print first column: block numbers
-current_row = row_start + 1
-for block in range(1, 9):
-    spreadsheet_timetable.setStyle("{0}:{1}".format(cell_coordinate(current_row, column_start+1), cell_coordinate(current_row, 5*appointment_width + column_start)), border_top=block_separator_border)
-    current_row += block_height[block] * appointment_height
-
-# now the vertical ones
-# no border right of Friday
-for weekday in range(1, 5):
-    weekday_column = column_start + 1 + (weekday-1) * appointment_width + 1
-    spreadsheet_timetable.setStyle("{0}:{1}".format(cell_coordinate(row_start, weekday_column), cell_coordinate(timetable_last_row - 1, weekday_column)), border_right=block_separator_border)
-
-print("Für die folgenden {0} Veranstaltungen wurde kein Termin im gewählten Zeitfenster gefunden:".format(len(courses_missed.values())))
-if not courses_missed:
-    print("\tkeine")
-else:
-    for course in courses_missed.values():
-        print("\t{0}, {1}, {2}".format(course.lvnr, course.name, course.lecturers))
-
-
-if os.path.exists(output_file):
-    if input("File '{0}' already exists, overwrite? (y/N) ".format(output_file)) == "y":
-        os.remove(output_file)
-    else:
-        print("Abort.")
-        exit(1)
+        if new_file:
+            csvwriter.writerow(['Name', 'Alias'])
+        for name in names:
+            csvwriter.writerow([name, ""])
+
+
+# the aliases of one alias file, kept in memory between updates; names are
+# interned like the lecturers and rooms of the courses, and names seen for
+# the first time are appended to the file instead of rewriting it
+class AliasFile:
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.aliases = {}
+        self.load()
+
+    def __getitem__(self, name):
+        return self.aliases[name]
+
+    def __contains__(self, name):
+        return name in self.aliases
+
+    def __len__(self):
+        return len(self.aliases)
+
+    def items(self):
+        return self.aliases.items()
+
+    # read the file again, return the names whose alias changed, including
+    # names that were added or removed
+    def load(self):
+        aliases = {sys.intern(name): alias for name, alias in load_aliases_from_filesystem(self.filename).items()}
+        changed = {name for name in self.aliases.keys() | aliases.keys() if self.aliases.get(name) != aliases.get(name)}
+        self.aliases = aliases
+        return changed
+
+    # add the names that are not in the file yet, return them
+    def add(self, names):
+        new_names = [name for name in dict.fromkeys(names) if name not in self.aliases]
+        if new_names:
+            append_aliases(self.filename, new_names)
+            for name in new_names:
+                self.aliases[name] = name
+        return new_names
+
+
+# the courses in one block of one weekday as shown in the timetable, with
+# their name, lecturers, rooms and dates, and the other blocks they take
+# place in, as dicts for the renderers
+def cell_entries(timetable, courses, weekday, block):
+    entries = []
+    for course_lvnr, appointments in timetable.cell(weekday, block).items():
+        course = courses[course_lvnr]
+        entries.append({
+            "weekday": weekday,
+            "block": block,
+            "lvnr": course_lvnr,
+            "name": course.name_short,
+            "name_vvz": course.name,
+            "lecturers": course.lecturers_rendered,
+            "rooms": list(dict.fromkeys(course.rooms_rendered[appointment.room] for appointment in appointments)),
+            "dates": [appointment.start.strftime("%d.%m.") for appointment in appointments],
+            "also": ["{0}/{1}".format(weekdays_short[weekday_other], block_other)
+                     for weekday_other, block_other in timetable.occurrences[course_lvnr]
+                     if not (weekday_other == weekday and block_other == block)]})
+    return entries
+
+
+# cell_entries of all cells, Monday's blocks first
+def timetable_entries(timetable, courses):
+    for weekday in timetable.weekdays:
+        for block in timetable.blocks.blocks():
+            yield from cell_entries(timetable, courses, weekday, block)
+
+
+# the dates of an entry and the other blocks of the course, as shown in the
+# timetable
+def entry_dates(entry):
+    dates = ", ".join(entry["dates"])
+    if entry["also"]:
+        dates += "; auch " + ", ".join(entry["also"])
+    return dates
+
+
+def write_timetable(config, timetable, courses, filename):
+    with config.metrics.phase("render_timetable", hot=True):
+        spreadsheet_timetable = OdsWriter(metrics=config.metrics)
+        blocks = timetable.blocks
+
+        # spreadsheet columns and rows start at 1, plus leave the first empty
+        column_start = 2
+        row_start = 3
+
+        # number of columns and rows per entry
+        appointment_width = 2
+        appointment_height = 3
+
+        block_height = timetable.block_height()
+
+        # print first column: block numbers
+        current_row = row_start + 1
+        for block in blocks.blocks():
+            print_cell(spreadsheet_timetable, current_row, column_start, str(block), config.font_size, config.font_family)
+            current_row += block_height[block] * appointment_height
+
+        # print timetable
+        print_cell(spreadsheet_timetable, 1, column_start + 1, "Evaluation", config.font_size_header, config.font_family)
+        print_cell(spreadsheet_timetable, 1, column_start + 4, "{0} bis {1}".format(timetable.starttime.strftime("%d.%m."), timetable.endtime.strftime("%d.%m.")), config.font_size_header, config.font_family)
+
+        for weekday in range(1, 6):
+            weekday_column = column_start + 1 + (weekday-1) * appointment_width
+            block_row_start = row_start + 1
+            print_cell(spreadsheet_timetable, row_start, weekday_column, weekdays[weekday], config.font_size_name, config.font_family)
+            for block in blocks.blocks():
+                for i, entry in enumerate(cell_entries(timetable, courses, weekday, block)):
+                    course_row_start = block_row_start + i*appointment_height
+                    print_cell(spreadsheet_timetable, course_row_start, weekday_column, entry["name"], config.font_size_name, config.font_family)
+                    print_cell(spreadsheet_timetable, course_row_start + 1, weekday_column, entry["lecturers"], config.font_size, config.font_family)
+                    print_cell(spreadsheet_timetable, course_row_start, weekday_column + 1, ", ".join(entry["rooms"]), config.font_size, config.font_family)
+                    print_cell(spreadsheet_timetable, course_row_start + 2, weekday_column, entry_dates(entry), config.font_size, config.font_family)
+                block_row_start += block_height[block] * appointment_height
+
+        # set borders on timetable
+
+        # first the horizontal ones
+        block_row_start = row_start + 1
+        timetable_last_row = sum(block_height.values()) * appointment_height + block_row_start
+        for row in range(block_row_start, timetable_last_row, 3):
+            spreadsheet_timetable.set_range_style(row, column_start+1, row, 5*appointment_width + column_start, border_top=config.block_separator_appointments)
+
+        # print first column: block numbers
+        current_row = row_start + 1
+        for block in blocks.blocks():
+            spreadsheet_timetable.set_range_style(current_row, column_start+1, current_row, 5*appointment_width + column_start, border_top=config.block_separator_border)
+            current_row += block_height[block] * appointment_height
+
+        # now the vertical ones
+        # no border right of Friday
+        for weekday in range(1, 5):
+            weekday_column = column_start + 1 + (weekday-1) * appointment_width + 1
+            spreadsheet_timetable.set_range_style(row_start, weekday_column, timetable_last_row - 1, weekday_column, border_right=config.block_separator_border)
+
+        # produce ODS file for timetable
+        spreadsheet_timetable.save(filename)
+
+
+# write the timetable as JSON: interval, start times of the blocks, one object
+# per course and block as in cell_entries and the courses without appointment
+def write_timetable_json(config, timetable, courses, filename):
+    with config.metrics.phase("render_json", hot=True), open(filename, 'w', encoding='utf8') as f:
+        f.write('{{"start": {0}, "end": {1}, "blocks": {2}, "entries": ['.format(
+            json.dumps(timetable.starttime.isoformat()), json.dumps(timetable.endtime.isoformat()),
+            json.dumps([start_time.strftime("%H:%M") for start_time in timetable.blocks.start_times])))
+        separator = "\n"
+        for entry in timetable_entries(timetable, courses):
+            f.write(separator + json.dumps(entry, ensure_ascii=False))
+            separator = ",\n"
+        f.write('\n], "missed": {0}}}\n'.format(json.dumps(list(timetable.missed))))
+
+
+# write the timetable as CSV, one row per course and block
+def write_timetable_csv(config, timetable, courses, filename):
+    with config.metrics.phase("render_csv", hot=True), open(filename, 'w', newline='', encoding='utf8') as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csvwriter.writerow(["Wochentag", "Block", "LVNR", "Name", "Dozenten", "Räume", "Termine", "Auch"])
+        for entry in timetable_entries(timetable, courses):
+            csvwriter.writerow([weekdays[entry["weekday"]], entry["block"], entry["lvnr"], entry["name"], entry["lecturers"],
+                                ", ".join(entry["rooms"]), ", ".join(entry["dates"]), ", ".join(entry["also"])])
+
+
+# write the timetable as a static HTML page, one row per block and one column
+# per weekday like the ODS file
+def write_timetable_html(config, timetable, courses, filename):
+    from html import escape
+
+    title = "Evaluation {0} bis {1}".format(timetable.starttime.strftime("%d.%m."), timetable.endtime.strftime("%d.%m."))
+    with config.metrics.phase("render_html", hot=True), open(filename, 'w', encoding='utf8') as f:
+        f.write('<!DOCTYPE html>\n<html lang="de">\n<head>\n<meta charset="utf-8">\n<title>{0}</title>\n'.format(escape(title)))
+        f.write("<style>\n"
+                "body {{ font-family: '{0}', sans-serif; font-size: {1}; }}\n"
+                "table {{ border-collapse: collapse; }}\n"
+                "th, td {{ border: 1px solid #000000; vertical-align: top; padding: 0.3em; }}\n"
+                "td {{ min-width: 12em; }}\n"
+                ".course + .course {{ border-top: 1px solid #999999; }}\n"
+                ".name {{ font-weight: bold; font-size: {2}; }}\n"
+                ".rooms {{ float: right; margin-left: 1em; }}\n"
+                "</style>\n</head>\n<body>\n".format(escape(config.font_family), config.font_size, config.font_size_name))
+        f.write("<h1>{0}</h1>\n<table>\n<tr><th></th>{1}</tr>\n".format(
+            escape(title), "".join("<th>{0}</th>".format(weekdays[weekday]) for weekday in timetable.weekdays)))
+        for block in timetable.blocks.blocks():
+            f.write("<tr><th>{0}</th>".format(block))
+            for weekday in timetable.weekdays:
+                f.write("<td>")
+                for entry in cell_entries(timetable, courses, weekday, block):
+                    f.write('<div class="course"><span class="rooms">{0}</span><div class="name">{1}</div>'
+                            '<div>{2}</div><div>{3}</div></div>'.format(
+                                escape(", ".join(entry["rooms"])), escape(entry["name"]),
+                                escape(entry["lecturers"]), escape(entry_dates(entry))))
+                f.write("</td>")
+            f.write("</tr>\n")
+        f.write("</table>\n</body>\n</html>\n")
+
+
+# print the timetable, by weekday and block
+def print_timetable(config, timetable, courses, filename):
+    print("Evaluation {0} bis {1}".format(timetable.starttime.strftime("%d.%m."), timetable.endtime.strftime("%d.%m.")))
+    for weekday in timetable.weekdays:
+        print(weekdays[weekday])
+        for block in timetable.blocks.blocks():
+            print("  {0}. Block".format(block))
+            for entry in cell_entries(timetable, courses, weekday, block):
+                print("    {0}, {1}".format(entry["name"], entry["lecturers"]))
+                print("      {0}; {1}".format(", ".join(entry["dates"]), ", ".join(entry["rooms"])))
+                if entry["also"]:
+                    print("      Auch {0}".format(", ".join(entry["also"])))
+
+
+# the formats the timetable can be written in, with the function writing it
+# and the extension of the file, which replaces the one of output_file
+timetable_renderers = {
+    "ods": (write_timetable, None),
+    "json": (write_timetable_json, ".json"),
+    "csv": (write_timetable_csv, ".csv"),
+    "html": (write_timetable_html, ".html"),
+    "terminal": (print_timetable, None),
+}
+
+
+# write the timetable in all formats of config.output_formats, filename is
+# the one of the ODS file
+def write_timetable_formats(config, timetable, courses, filename):
+    for output_format in config.output_formats:
+        renderer, extension = timetable_renderers[output_format]
+        if extension is not None:
+            renderer(config, timetable, courses, os.path.splitext(filename)[0] + extension)
+        else:
+            renderer(config, timetable, courses, filename)
 
-# produce ODS file for timetable
-Sods_ods = SodsOds(spreadsheet_timetable)
-Sods_ods.save(output_file)
 
 # produce ODS file for comparison of input and output
-with open(input_file, newline='') as csvfile_input:
-    spamreader = csv.reader(csvfile_input, delimiter=',', quotechar='"')
-
-    first_line = True
-    for i, row in enumerate(spamreader):
-        if first_line:
-            # copy the table header
-            print_row(spreadsheet_output_comparison, i+1, row)
-            spreadsheet_output_comparison.setValue(cell_coordinate(i+1, output_comparison_col_name_vvz), "Name aus VVZ")
-            spreadsheet_output_comparison.setValue(cell_coordinate(i+1, output_comparison_col_found_appointment), "Termin gefunden?")
-            first_line = False
-        else:
-            print_row(spreadsheet_output_comparison, i+1, row)
-            if int(row[0]) not in courses_missed and int(row[0]) not in courses:
-                found_appointment = "…"
-            elif int(row[0]) not in courses_missed:
-                found_appointment = "ja"
+def write_output_comparison(config, input_rows, courses, timetable, filename):
+    with config.metrics.phase("render_output", hot=True):
+        spreadsheet_output_comparison = OdsWriter(metrics=config.metrics)
+        courses_missed = timetable.missed
+
+        first_line = True
+        for i, row in enumerate(input_rows):
+            if first_line:
+                # copy the table header
+                print_row(spreadsheet_output_comparison, i+1, row, config.font_size, config.font_family)
+                spreadsheet_output_comparison.set_value(i+1, output_comparison_col_name_vvz, "Name aus VVZ")
+                spreadsheet_output_comparison.set_value(i+1, output_comparison_col_found_appointment, "Termin gefunden?")
+                first_line = False
             else:
-                found_appointment = "nein"
-            if found_appointment != "…":
-                spreadsheet_output_comparison.setValue(cell_coordinate(i+1, output_comparison_col_name_vvz), courses[int(row[0])].name)
-                spreadsheet_output_comparison.setValue(cell_coordinate(i+1, output_comparison_col_found_appointment), found_appointment)
-                # color the cell if the name is different as this could be an issue
-                if row[2] != courses[int(row[0])].name:
-                    spreadsheet_output_comparison.setStyle(cell_coordinate(i+1, output_comparison_col_name_vvz), background_color= "#ff0000")
-            # color the cell if no appointment was found in the given time interval
-            if found_appointment == "nein":
-                spreadsheet_output_comparison.setStyle(cell_coordinate(i+1, output_comparison_col_found_appointment), background_color= "#ff0000")
-            elif found_appointment == "…":
-                spreadsheet_output_comparison.setStyle(cell_coordinate(i+1, output_comparison_col_found_appointment), background_color= "#ffffe0")
-
-
-if os.path.exists(output_comparison_file):
-    if input("File '{0}' already exists, overwrite? (y/N) ".format(output_comparison_file)) == "y":
-        os.remove(output_comparison_file)
+                print_row(spreadsheet_output_comparison, i+1, row, config.font_size, config.font_family)
+                if is_excluded(row):
+                    found_appointment = "…"
+                elif int(row[0]) not in courses:
+                    # the course could neither be downloaded nor be found in
+                    # the course store
+                    found_appointment = "nicht geladen"
+                elif int(row[0]) not in courses_missed:
+                    found_appointment = "ja"
+                else:
+                    found_appointment = "nein"
+                if found_appointment == "nicht geladen":
+                    spreadsheet_output_comparison.set_value(i+1, output_comparison_col_found_appointment, found_appointment)
+                elif found_appointment != "…":
+                    spreadsheet_output_comparison.set_value(i+1, output_comparison_col_name_vvz, courses[int(row[0])].name)
+                    spreadsheet_output_comparison.set_value(i+1, output_comparison_col_found_appointment, found_appointment)
+                    # color the cell if the name is different as this could be an issue
+                    if row[2] != courses[int(row[0])].name:
+                        spreadsheet_output_comparison.set_style(i+1, output_comparison_col_name_vvz, background_color="#ff0000")
+                # color the cell if no appointment was found in the given time interval
+                if found_appointment in ("nein", "nicht geladen"):
+                    spreadsheet_output_comparison.set_style(i+1, output_comparison_col_found_appointment, background_color="#ff0000")
+                elif found_appointment == "…":
+                    spreadsheet_output_comparison.set_style(i+1, output_comparison_col_found_appointment, background_color="#ffffe0")
+
+        spreadsheet_output_comparison.save(filename)
+
+
+def print_courses_missed(timetable):
+    courses_missed = timetable.missed
+    print("Für die folgenden {0} Veranstaltungen wurde kein Termin im gewählten Zeitfenster gefunden:".format(len(courses_missed.values())))
+    if not courses_missed:
+        print("\tkeine")
+    else:
+        for course in courses_missed.values():
+            print("\t{0}, {1}, {2}".format(course.lvnr, course.name, course.lecturers))
+
+
+# ask before an existing file is overwritten, abort if the answer is no
+def confirm_overwrite(filename, prompt=True):
+    if prompt and os.path.exists(filename):
+        if input("File '{0}' already exists, overwrite? (y/N) ".format(filename)) == "y":
+            os.remove(filename)
+        else:
+            print("Abort.")
+            exit(1)
+
+
+# parse the start or end of an interval, either in KitHub's datetime format
+# or just a date like 2015-06-01, which then means the whole day
+def parse_window_time(string, end=False):
+    if len(string) == 10:
+        day = datetime.strptime(string, "%Y-%m-%d")
+        return day.replace(hour=23, minute=59, second=59) if end else day
+    return parse_datetime_fast(string)
+
+
+# name of the timetable file of one interval when there are several
+def window_filename(filename, starttime, endtime):
+    base, extension = os.path.splitext(filename)
+    return "{0}_{1}_{2}{3}".format(base, starttime.strftime("%Y-%m-%d"), endtime.strftime("%Y-%m-%d"), extension)
+
+
+# data shared by all processes generating timetables for several intervals
+window_worker_data = None
+
+
+def init_window_worker(config, courses, blocks):
+    global window_worker_data
+    window_worker_data = (config, courses, blocks)
+
+
+# build and write the timetable of one interval, return the timetable with
+# all courses and the one that was written, with the visits planned
+def run_window(window):
+    config, courses, blocks = window_worker_data
+    starttime, endtime = window
+    timetable = build_timetable(courses, starttime, endtime, blocks, config.metrics)
+    planned = plan_visits(config, timetable)
+    write_timetable_formats(config, planned, courses, window_filename(config.output_file, starttime, endtime))
+    return timetable, planned
+
+
+# run_window in a worker process, with metrics of its own that are returned
+# to be merged into the metrics of the parent; each worker process has its
+# own copy of the configuration
+def run_window_in_worker(window):
+    config = window_worker_data[0]
+    config.metrics = Metrics(config.metrics.hooks)
+    return run_window(window) + (config.metrics.as_dict(),)
+
+
+# build the timetables of several intervals from the same courses, with
+# a pool of processes if processes is greater than 1; return the timetables
+# with all courses, e.g. to update them later, and the ones that were written
+def run_windows(config, windows, courses, blocks, processes=1):
+    if processes > 1 and len(windows) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_window_worker,
+                                 initargs=(config, courses, blocks)) as executor:
+            results = []
+            for timetable, planned, window_metrics in executor.map(run_window_in_worker, windows):
+                config.metrics.merge(window_metrics)
+                results.append((timetable, planned))
     else:
-        print("Abort.")
-        exit(1)
+        init_window_worker(config, courses, blocks)
+        try:
+            results = [run_window(window) for window in windows]
+        finally:
+            init_window_worker(None, None, None)
+    for timetable, planned in results:
+        print_visits(config, planned)
+    return [timetable for timetable, planned in results], [planned for timetable, planned in results]
+
+
+# print and write an overview of the timetables of several intervals, with
+# the number of courses without appointment and the largest number of
+# parallel courses in each block
+def write_windows_summary(timetables, filename):
+    blocks = timetables[0].blocks
+    header = ["Beginn", "Ende", "Veranstaltungen", "ohne Termin"] + ["Block {0}".format(block) for block in blocks.blocks()] + ["ohne Termin (LVNR)"]
+    rows = []
+    for timetable in timetables:
+        load = timetable.block_load()
+        rows.append([timetable.starttime.strftime("%d.%m.%Y"), timetable.endtime.strftime("%d.%m.%Y"),
+                     len(timetable.occurrences), len(timetable.missed)] + [load[block] for block in blocks.blocks()] +
+                    [" ".join(str(lvnr) for lvnr in timetable.missed)])
+    with open(filename, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+        csvwriter.writerow(header)
+        csvwriter.writerows(rows)
+
+    print("Vergleich der Zeitfenster (größte Zahl paralleler Veranstaltungen je Block):")
+    print("\t" + "\t".join(header[:-1]))
+    for row in rows:
+        print("\t" + "\t".join(str(cell) for cell in row[:-1]))
+        if row[-1]:
+            print("\t\tohne Termin: {0}".format(row[-1]))
+
+
+def read_input(filename):
+    with open(filename, newline='') as csvfile:
+        spamreader = csv.reader(csvfile, delimiter=',', quotechar='"')
+        return list(spamreader)
+
+
+def is_excluded(row):
+    return row[output_comparison_col_exclude - 1] == "x"
+
+
+# course numbers of the rows of an input file that are not excluded
+def input_course_numbers(input_rows):
+    return [row[0] for row in input_rows[1:] if not is_excluded(row)]
+
+
+# set name and category of a course as given in its row of the input file
+def apply_input_row(config, course, row):
+    course.category = row[1]
+    course.name_short = row[2]
+    if row[output_comparison_col_uebung - 1] == "x":
+        course.name_short += " +Übung"
+    if row[output_comparison_col_praktikum - 1] == "x":
+        course.name_short += " +Prakt"
+    if config.show_course_of_studies and row[1] != "":
+        course.name_short += " ({0})".format(row[1])
+
+
+# download all given courses at once, then load them from the store in one go
+# courses that could not be downloaded are missing in the returned dict; with
+# fetch=False, only the courses already in the store are loaded
+def load_courses(config, course_numbers, import_json=False, fetch=True):
+    course_store = CourseStore(config.course_store_file)
+    if import_json:
+        with config.metrics.phase("import_json"):
+            course_store.import_directory(config.json_directory, config.term_id, config.cache_manifest_file,
+                                          config.decode_processes, config.decode_chunk_size)
+    if fetch:
+        with config.metrics.phase("fetch"):
+            get_courses(course_store, course_numbers, config)
+    with config.metrics.phase("store_load"):
+        if config.load_window_only:
+            windows = config.windows()
+            courses_loaded = course_store.load_courses(config.term_id, course_numbers, min(start for start, end in windows),
+                                                       max(end for start, end in windows))
+        else:
+            courses_loaded = course_store.load_courses(config.term_id, course_numbers)
+    course_store.close()
+    config.metrics.count("courses_loaded", len(courses_loaded))
+    return courses_loaded
+
+
+# yield the courses of the input rows that are not excluded, in the order of
+# the input file
+def iter_courses(config, input_rows, courses_loaded):
+    for row in input_rows[1:]:
+        if not is_excluded(row):
+            # skip courses that could not be downloaded
+            if int(row[0]) not in courses_loaded:
+                continue
+            course = courses_loaded[int(row[0])]
+            apply_input_row(config, course, row)
+            yield course
+
+
+# holds all courses of the input rows that are not excluded as Course objects
+# with course.lvnr as key, in the order of the input file
+def courses_from_input(config, input_rows, courses_loaded):
+    return {course.lvnr: course for course in iter_courses(config, input_rows, courses_loaded)}
+
+
+# add lecturers and rooms of the courses that have no alias yet to the
+# alias files, and render the aliases of the courses for the timetable
+def update_aliases(config, courses, lecturers, rooms):
+    courses = list(courses)
+
+    # check if there are more lecturers
+    if lecturers.add(lecturer for course in courses for lecturer in course.lecturers):
+        verbose("Courses have lecturers that are not yet in {0}".format(config.lecturers_file))
+
+    # check if there are more rooms
+    if rooms.add(appointment.room for course in courses for appointment in course.appointments):
+        verbose("Courses have rooms that are not yet in {0}".format(config.rooms_file))
+
+    for course in courses:
+        course.lecturers_rendered = ", ".join([lecturers[_] for _ in course.lecturers])
+        course.rooms_rendered = {room: rooms[room] for room in {appointment.room for appointment in course.appointments}}
+
+
+# write the timetable, and the comparison of input and output if there is
+# only one interval, or one timetable per interval and a summary
+def write_outputs(config, timetables, courses, input_rows, prompt=True):
+    timetables = [plan_visits(config, timetable) for timetable in timetables]
+    for timetable in timetables:
+        print_visits(config, timetable)
+    if len(timetables) > 1:
+        for timetable in timetables:
+            write_timetable_formats(config, timetable, courses, window_filename(config.output_file, timetable.starttime, timetable.endtime))
+        write_windows_summary(timetables, config.windows_summary_file)
+        return
+
+    print_courses_missed(timetables[0])
+
+    # the other formats are previews, which are overwritten without asking
+    if "ods" in config.output_formats:
+        confirm_overwrite(config.output_file, prompt)
+    write_timetable_formats(config, timetables[0], courses, config.output_file)
+
+    if "ods" in config.output_formats:
+        confirm_overwrite(config.output_comparison_file, prompt)
+        write_output_comparison(config, input_rows, courses, timetables[0], config.output_comparison_file)
+
+
+###
+# Library interface
+# load, filter, bucket and render the courses of a Config step by step, or
+# build all timetables at once with generate()
+###
+
+# download and load the courses of all rows of the input file that are not
+# excluded, return them with course.lvnr as key in the order of the input
+def load(config, input_rows=None):
+    if input_rows is None:
+        input_rows = read_input(config.input_file)
+    return courses_from_input(config, input_rows, load_courses(config, input_course_numbers(input_rows)))
+
+
+# appointments of each course within the interval, with course.lvnr as key
+def filter_appointments(courses, starttime, endtime):
+    return {course_lvnr: course.appointments_between(starttime, endtime) for course_lvnr, course in courses.items()}
+
+
+# sort the courses into one Timetable per interval of the configuration
+def bucket(config, courses):
+    return build_timetables(courses, config.windows(), config.blocks(), config.metrics)
+
+
+# write the outputs for timetables built by bucket, without asking
+def render(config, timetables, courses, input_rows=None):
+    if input_rows is None:
+        input_rows = read_input(config.input_file)
+    lecturers = AliasFile(config.lecturers_file)
+    rooms = AliasFile(config.rooms_file)
+    update_aliases(config, courses.values(), lecturers, rooms)
+    write_outputs(config, timetables, courses, input_rows, prompt=False)
+
+
+# load the courses and return them together with the timetable of each
+# interval of the configuration, nothing is written except the course store
+def generate(config):
+    courses = load(config)
+    return courses, bucket(config, courses)
+
+
+# keeps courses and timetables in memory and updates them whenever the input
+# file or the alias files change
+class Watcher:
+
+    def __init__(self, config, input_rows, courses, lecturers, rooms, timetables):
+        self.config = config
+        self.input_rows = input_rows
+        self.courses = courses
+        self.lecturers = lecturers
+        self.rooms = rooms
+        self.timetables = timetables
+        self.mtimes = self.current_mtimes()
+
+    def current_mtimes(self):
+        return {filename: os.path.getmtime(filename) if os.path.exists(filename) else None
+                for filename in (self.config.input_file, self.config.lecturers_file, self.config.rooms_file)}
+
+    def run(self):
+        config = self.config
+        print("Watching {0}, {1} and {2} for changes, press Ctrl+C to stop.".format(config.input_file, config.lecturers_file, config.rooms_file))
+        try:
+            while True:
+                sleep(config.watch_interval)
+                mtimes = self.current_mtimes()
+                changed = {filename for filename in mtimes if mtimes[filename] != self.mtimes[filename]}
+                if changed:
+                    self.update(changed)
+        except KeyboardInterrupt:
+            print()
+
+    def update(self, changed):
+        config = self.config
+        start = perf_counter()
+        try:
+            lecturers_changed = self.lecturers.load() if config.lecturers_file in changed else set()
+            rooms_changed = self.rooms.load() if config.rooms_file in changed else set()
+            added = self.update_input() if config.input_file in changed else []
+            # courses added to the input and courses with changed aliases,
+            # including names removed from the alias files, need new aliases
+            affected = {course.lvnr: course for course in added}
+            if lecturers_changed or rooms_changed:
+                affected.update((course.lvnr, course) for course in self.courses.values()
+                                if not lecturers_changed.isdisjoint(course.lecturers)
+                                or not rooms_changed.isdisjoint(course.rooms_rendered))
+            update_aliases(config, affected.values(), self.lecturers, self.rooms)
+            write_outputs(config, self.timetables, self.courses, self.input_rows, prompt=False)
+        except (OSError, ValueError, IndexError) as err:
+            print("ERROR: Could not update the timetable: {0}".format(err))
+        # ignore the changes of the alias files made by the update itself
+        self.mtimes = self.current_mtimes()
+        print("Updated after changes in {0} in {1:.0f} ms.".format(", ".join(sorted(changed)), (perf_counter() - start) * 1000))
+
+    # compare the input file with the version in memory and update only the
+    # courses of changed rows, return the courses that were added
+    def update_input(self):
+        input_rows = read_input(self.config.input_file)
+        old_rows = {row[0]: row for row in self.input_rows[1:]}
+        new_rows = {row[0]: row for row in input_rows[1:]}
+        changed = {lvnr for lvnr in old_rows.keys() | new_rows.keys() if old_rows.get(lvnr) != new_rows.get(lvnr)}
+        order_changed = list(old_rows) != list(new_rows)
+        self.input_rows = input_rows
+        if not changed and not order_changed:
+            return []
+        verbose("Changed rows in {0}: {1}".format(self.config.input_file, ", ".join(sorted(changed))))
+
+        # only download and load courses of changed rows that are not in
+        # memory yet, so failed downloads are not retried on every change
+        missing = [row[0] for row in input_rows[1:]
+                   if row[0] in changed and not is_excluded(row) and int(row[0]) not in self.courses]
+        courses_loaded = load_courses(self.config, missing) if missing else {}
+        previous = self.courses
+        courses_loaded.update(previous)
+        self.courses = courses_from_input(self.config, input_rows, courses_loaded)
+        position = {course_lvnr: i for i, course_lvnr in enumerate(self.courses)}
+        added = self.courses.keys() - previous.keys()
+
+        changed_courses = {int(lvnr) for lvnr in changed} | added
+        for timetable in self.timetables:
+            cells = set()
+            for course_lvnr in changed_courses:
+                cells.update(timetable.remove_course(course_lvnr))
+            for course_lvnr in changed_courses:
+                if course_lvnr in self.courses:
+                    cells.update(timetable.add_course(self.courses[course_lvnr]))
+            if order_changed:
+                cells = timetable.cells()
+            timetable.sort(position, cells)
+        return [self.courses[course_lvnr] for course_lvnr in added]
+
+
+###
+# Jobs
+# run several configurations, e.g. for several departments or terms, from a
+# manifest in a pool of processes that share one course store
+###
+
+# read a manifest of jobs, a JSON object with a list of "jobs", each with a
+# "name" and the options of its Config, and optionally "defaults" with
+# options for all jobs; return a list of (name, Config) pairs
+def read_jobs(filename):
+    with open(filename, 'r') as f:
+        manifest = json.load(f)
+    defaults = manifest.get("defaults", {})
+    jobs = []
+    for i, job in enumerate(manifest["jobs"]):
+        options = dict(defaults)
+        options.update(job)
+        name = str(options.pop("name", "job {0}".format(i + 1)))
+        try:
+            jobs.append((name, Config(**options)))
+        except TypeError as err:
+            raise ValueError("{0} in job '{1}' of {2}".format(err, name, filename))
+    return jobs
+
+
+# download the courses of all jobs, each course only once for all jobs that
+# share a course store and term; the options of the first job of each term
+# are used for downloading
+def fetch_jobs(jobs, metrics):
+    groups = {}
+    for name, config in jobs:
+        try:
+            course_numbers = input_course_numbers(read_input(config.input_file))
+        except (OSError, IndexError):
+            # reported when the job is run
+            continue
+        group = groups.setdefault((config.course_store_file, config.term_id), (config, {}))
+        group[1].update(dict.fromkeys(course_numbers))
+    for (course_store_file, term), (config, course_numbers) in groups.items():
+        print("Downloading {0} courses of term {1} for all jobs.".format(len(course_numbers), term))
+        config = shared_job_config(config, metrics)
+        course_store = CourseStore(course_store_file)
+        with metrics.phase("fetch"):
+            get_courses(course_store, list(course_numbers), config)
+        course_store.close()
+
+
+# a copy of the configuration of a job for work done for all jobs, which is
+# recorded in metrics instead of the metrics of the job
+def shared_job_config(config, metrics):
+    import copy
+
+    config = copy.copy(config)
+    config.metrics = metrics
+    return config
+
+
+# add the lecturers and rooms that are new to alias files used by several
+# jobs before the jobs run in parallel, so the jobs do not append the same
+# names to one file at the same time
+def add_job_aliases(jobs, metrics):
+    users = {}
+    for name, config in jobs:
+        for filename in {os.path.abspath(config.lecturers_file), os.path.abspath(config.rooms_file)}:
+            users[filename] = users.get(filename, 0) + 1
+    alias_files = {}
+    for name, config in jobs:
+        lecturers_file = os.path.abspath(config.lecturers_file)
+        rooms_file = os.path.abspath(config.rooms_file)
+        if users[lecturers_file] == 1 and users[rooms_file] == 1:
+            continue
+        try:
+            input_rows = read_input(config.input_file)
+        except (OSError, IndexError):
+            # reported when the job is run
+            continue
+        config = shared_job_config(config, metrics)
+        courses = courses_from_input(config, input_rows, load_courses(config, input_course_numbers(input_rows), fetch=False))
+        with metrics.phase("aliases"):
+            if lecturers_file not in alias_files:
+                alias_files[lecturers_file] = AliasFile(config.lecturers_file)
+            if rooms_file not in alias_files:
+                alias_files[rooms_file] = AliasFile(config.rooms_file)
+            alias_files[lecturers_file].add(lecturer for course in courses.values() for lecturer in course.lecturers)
+            alias_files[rooms_file].add(appointment.room for course in courses.values() for appointment in course.appointments)
+
+
+# run one job with the courses in the store, without asking before files are
+# overwritten; return its name, the time it took, its metrics and its
+# output, and the error if it failed
+def run_job(job):
+    name, config = job
+    output = io.StringIO()
+    start = perf_counter()
+    error = None
+    try:
+        with redirect_stdout(output):
+            with config.metrics.phase("read_input"):
+                input_rows = read_input(config.input_file)
+            courses = courses_from_input(config, input_rows, load_courses(
+                config, input_course_numbers(input_rows), fetch=False))
+            timetables = bucket(config, courses)
+            render(config, timetables, courses, input_rows)
+    except Exception as err:
+        # one failing job must not stop the others
+        error = "{0}: {1}".format(type(err).__name__, err)
+    return {'name': name, 'seconds': perf_counter() - start, 'error': error,
+            'metrics': config.metrics.as_dict(), 'output': output.getvalue()}
+
+
+# download the courses of all jobs once, then run the jobs in processes
+# parallel processes, return the result of run_job for each job; the
+# downloads are recorded in metrics, if given, each job in the metrics of
+# its configuration
+def run_jobs(jobs, processes=1, metrics=None):
+    if metrics is None:
+        metrics = Metrics()
+    fetch_jobs(jobs, metrics)
+    if processes > 1 and len(jobs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        add_job_aliases(jobs, metrics)
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            return list(executor.map(run_job, jobs))
+    return [run_job(job) for job in jobs]
+
+
+# print the output of each job and a table of the time each job took, the
+# number of its courses and the courses without appointment
+def print_job_results(results):
+    for result in results:
+        print("== {0} ==".format(result['name']))
+        print(result['output'], end="")
+    print("Job                        Time  Courses   Missed")
+    for result in results:
+        if result['error'] is not None:
+            print("{0:20} FAILED: {1}".format(result['name'], result['error']))
+            continue
+        counters = result['metrics']['counters']
+        print("{0:20} {1:8.2f} s {2:8} {3:8}".format(result['name'], result['seconds'],
+                                                    counters.get('courses_loaded', 0), counters.get('courses_missed', 0)))
+
+
+def build_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate a timetable for the evaluation of lectures.")
+    parser.add_argument("--refresh", choices=["stale", "all", "none"], default=refresh_policy,
+                        help="which downloaded courses to revalidate with the API (default: {0})".format(refresh_policy))
+    parser.add_argument("--format", action="append", choices=sorted(timetable_renderers), dest="formats",
+                        help="format of the timetable, can be given several times; ods also writes {0} "
+                             "(default: {1})".format(output_comparison_file, " ".join(output_formats)))
+    parser.add_argument("--bulk", action="store_true", default=fetch_bulk,
+                        help="download the listing of all courses of the term in a few requests instead of one request per course")
+    parser.add_argument("--block-scheme", choices=sorted(block_schemes), default=block_scheme,
+                        help="which start times of blocks to use (default: {0})".format(block_scheme))
+    parser.add_argument("--window", nargs=2, action="append", default=[], metavar=("START", "END"),
+                        help="generate a timetable for this interval as well, can be given several times, "
+                             "e.g. --window 2015-06-01 2015-06-19")
+    parser.add_argument("--processes", type=int, default=window_processes,
+                        help="number of processes generating the timetables of several intervals or running the jobs of --jobs (default: {0})".format(window_processes))
+    parser.add_argument("--assign", action="store_true", default=assign_visits,
+                        help="pick one appointment per course to visit, spread over the blocks, and only show that one")
+    parser.add_argument("--teams", type=int, default=evaluator_teams,
+                        help="number of evaluator teams, for --assign (default: {0}, no limit)".format(evaluator_teams))
+    parser.add_argument("--decode-processes", type=int, default=decode_processes,
+                        help="number of processes decoding the JSON files of earlier versions (default: {0})".format(decode_processes))
+    parser.add_argument("--window-only", action="store_true", default=load_window_only,
+                        help="load only the appointments within the intervals, to save memory on large inputs")
+    parser.add_argument("--profile", action="store_true",
+                        help="print the time spent in each phase and counters of what was done")
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="write the time spent in each phase and the counters as JSON to FILE")
+    parser.add_argument("--profile-hooks", choices=["cprofile", "tracemalloc"],
+                        help="profile building the timetable and writing the ODS files with cProfile, "
+                             "or measure their peak memory with tracemalloc")
+    parser.add_argument("--jobs", metavar="FILE",
+                        help="run the jobs of a JSON manifest instead, in --processes parallel processes sharing the course store")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and update the outputs whenever the input or alias files change, without asking before overwriting")
+    return parser
+
+
+def main():
+    args = build_parser().parse_args()
+
+    if args.jobs:
+        try:
+            jobs = read_jobs(args.jobs)
+        except (OSError, ValueError, KeyError) as err:
+            print("ERROR: Could not read the jobs in {0}: {1}".format(args.jobs, err))
+            exit(1)
+        metrics = Metrics(args.profile_hooks)
+        results = run_jobs(jobs, args.processes, metrics)
+        print_job_results(results)
+        if args.metrics:
+            with open(args.metrics, 'w') as f:
+                json.dump({'fetch': metrics.as_dict(),
+                           'jobs': [{key: result[key] for key in ('name', 'seconds', 'error', 'metrics')} for result in results]},
+                          f, indent=2)
+        if any(result['error'] is not None for result in results):
+            exit(1)
+        return
+
+    config = Config(metrics=Metrics(args.profile_hooks), refresh_policy=args.refresh, fetch_bulk=args.bulk, block_scheme=args.block_scheme,
+                    assign_visits=args.assign, evaluator_teams=args.teams, decode_processes=args.decode_processes,
+                    load_window_only=args.window_only, output_formats=args.formats or output_formats)
+    config.eva_windows = config.eva_windows + args.window
+    timetable_blocks = config.blocks()
+    windows = config.windows()
+
+    for eva_starttime, eva_endtime in windows:
+        print("Printing time interval {0} to {1}".format(eva_starttime, eva_endtime))
+
+    with config.metrics.phase("read_input"):
+        input_rows = read_input(config.input_file)
+    courses = courses_from_input(config, input_rows, load_courses(config, input_course_numbers(input_rows), import_json=True))
+
+    # holds aliases for lecturers and rooms
+    with config.metrics.phase("aliases"):
+        lecturers = AliasFile(config.lecturers_file)
+        rooms = AliasFile(config.rooms_file)
+        update_aliases(config, courses.values(), lecturers, rooms)
+
+    if len(windows) > 1:
+        # ask for all files first, the timetables may be written in parallel
+        for eva_starttime, eva_endtime in windows:
+            if "ods" in config.output_formats:
+                confirm_overwrite(window_filename(config.output_file, eva_starttime, eva_endtime), not args.watch)
+        timetables, planned = run_windows(config, windows, courses, timetable_blocks, args.processes)
+        write_windows_summary(planned, config.windows_summary_file)
+    else:
+        eva_starttime, eva_endtime = windows[0]
+
+        # assemble the timetable
+        timetables = [build_timetable(courses, eva_starttime, eva_endtime, timetable_blocks, config.metrics)]
+        write_outputs(config, timetables, courses, input_rows, not args.watch)
+
+    if args.profile or args.profile_hooks:
+        config.metrics.print_summary()
+    if args.metrics:
+        config.metrics.write(args.metrics)
+
+    if args.watch:
+        Watcher(config, input_rows, courses, lecturers, rooms, timetables).run()
+
 
-Sods_ods = SodsOds(spreadsheet_output_comparison)
-Sods_ods.save(output_comparison_file)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+'''
+Checks for evaluation.py that run offline, against the stub of the API of
+benchmark.py.
+
+Run with `python -m unittest` or `python -m pytest`.
+
+@package test_evaluation
+'''
+import os
+import io
+import json
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+
+import evaluation
+import benchmark
+
+
+# split data into chunks at the given positions
+def split(data, positions):
+    positions = [0] + sorted(positions) + [len(data)]
+    return [data[start:end] for start, end in zip(positions, positions[1:])]
+
+
+class IterJsonArrayTest(unittest.TestCase):
+
+    listing = [{"no": "1", "name": "Müller"}, -350000.0, 12, 1.5e-3, "a, b", True, None, [], {}]
+
+    def test_every_split(self):
+        data = json.dumps(self.listing).encode('utf8')
+        for first in range(len(data) + 1):
+            for second in range(first, min(len(data), first + 8) + 1):
+                chunks = split(data, [first, second])
+                self.assertEqual(list(evaluation.iter_json_array(chunks)), self.listing, chunks)
+
+    def test_single_bytes(self):
+        data = json.dumps(self.listing, indent=1).encode('utf8')
+        self.assertEqual(list(evaluation.iter_json_array(split(data, range(len(data))))), self.listing)
+
+    def test_numbers(self):
+        self.assertEqual(list(evaluation.iter_json_array([b'[12', b'34]'])), [1234])
+        self.assertEqual(list(evaluation.iter_json_array([b'[-350', b'000.', b'0]'])), [-350000.0])
+        self.assertEqual(list(evaluation.iter_json_array([b'[1', b'e', b'+', b'3]'])), [1e3])
+
+    def test_errors(self):
+        for chunks in ([b'{}'], [b'[12'], [b'[1 2]'], [b'[1,]']):
+            with self.assertRaises(ValueError):
+                list(evaluation.iter_json_array(chunks))
+
+
+class BulkFetchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.replies = benchmark.generate_courses(23, 4, 5, 5)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def fetch(self, server, page_size):
+        config = evaluation.Config(term_id=benchmark.term_id, api_url=server.url, api_bulk_url=server.bulk_url,
+                                   bulk_page_size=page_size, fetch_bulk=True, fetch_rate_limit=0,
+                                   course_store_file=os.path.join(self.directory.name, "courses.sqlite"))
+        store = evaluation.CourseStore(config.course_store_file)
+        try:
+            with redirect_stdout(io.StringIO()):
+                failed = evaluation.get_courses(store, list(self.replies), config)
+            courses = store.load_courses(config.term_id, list(self.replies))
+        finally:
+            store.close()
+        return failed, courses
+
+    def test_pages(self):
+        server = benchmark.StubServer(self.replies)
+        try:
+            failed, courses = self.fetch(server, 5)
+        finally:
+            server.stop()
+        self.assertEqual(failed, set())
+        self.assertEqual(sorted(courses), sorted(int(lvnr) for lvnr in self.replies))
+        self.assertEqual(server.requests, 5)
+
+    def test_server_without_paging(self):
+        server = benchmark.StubServer(self.replies, paging=False)
+        try:
+            failed, courses = self.fetch(server, 5)
+        finally:
+            server.stop()
+        self.assertEqual(failed, set())
+        self.assertEqual(len(courses), len(self.replies))
+        self.assertEqual(server.requests, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()